@@ -4,10 +4,21 @@ Fast implementation for production streaming
 """
 
 import modal
+import hashlib
 import json
 import logging
+import os
+import queue
+import re
+import resource
+import sys
+import time
+import unicodedata
 import uuid
-from threading import Thread
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from concurrent.futures import Future
+from threading import Condition, Event, Lock, Thread
 
 # Create app
 app = modal.App("two-container-sanskrit-tts")
@@ -21,7 +32,9 @@ tts_image = (
         "transformers>=4.40.0", 
         "soundfile>=0.12.1",
         "accelerate>=0.21.0",
-        "numpy>=1.24.0"
+        "numpy>=1.24.0",
+        "scipy>=1.10.0",  # Polyphase resampling for sample_rate negotiation
+        "av>=12.0.0"      # Ogg/Opus streaming output (bundles libopus)
     ])
     .pip_install("git+https://github.com/huggingface/parler-tts.git")
 )
@@ -29,6 +42,50 @@ tts_image = (
 # WebSocket image
 websocket_image = modal.Image.debian_slim().pip_install("fastapi[standard]", "websockets")
 
+# Per-container counters (caches, scheduler) published by the TTS containers so the
+# websocket health check can report them without waking a GPU container
+tts_service_stats = modal.Dict.from_name("tts-service-stats", create_if_missing=True)
+
+output_vol = modal.Volume.from_name("tts-files", create_if_missing=True)
+
+# Learned tokens-per-unit statistics per "voice:script", shared by all TTS containers
+tts_token_budget = modal.Dict.from_name("tts-token-budget", create_if_missing=True)
+
+# request_ids whose stream should stop (barge-in). Written by the websocket server,
+# checked by the TTS container once per streamed audio chunk.
+tts_cancellations = modal.Dict.from_name("tts-cancellations", create_if_missing=True)
+
+# Connected browser clients of tts_gateway with their outbox depth, republished by the
+# gateway so the depth of each client's queue can be watched from outside
+tts_gateway_stats = modal.Dict.from_name("tts-gateway-stats", create_if_missing=True)
+
+MODEL_ID = "ai4bharat/indic-parler-tts"
+MODEL_REVISION = "main"
+
+# Pre-cast fp16 safetensors + tokenizers on the tts-files volume (see create_weight_snapshot).
+# When present and built from MODEL_ID at MODEL_REVISION, load_model memory-maps it instead
+# of downloading and casting the hub checkpoint; a stale one is rebuilt in the background.
+WEIGHT_SNAPSHOT_DIR = "/output/snapshots/indic-parler-tts-fp16"
+WEIGHT_SNAPSHOT_MANIFEST = "snapshot.json"
+
+
+def read_snapshot_manifest():
+    """The weight snapshot's manifest, or None if there is no (readable) snapshot"""
+    try:
+        with open(os.path.join(WEIGHT_SNAPSHOT_DIR, WEIGHT_SNAPSHOT_MANIFEST)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def snapshot_matches(manifest) -> bool:
+    """Whether a snapshot manifest is for the model this code serves"""
+    return bool(manifest) and (
+        manifest.get("model_id") == MODEL_ID
+        and manifest.get("revision") == MODEL_REVISION
+        and manifest.get("dtype") == "float16"
+    )
+
 # Voice configs
 VOICE_CONFIGS = {
     "aryan_default": "Aryan speaks in a warm, respectful tone suitable for Sanskrit conversation while ensuring proper halant pronunciations and clear consonant clusters",
@@ -37,6 +94,10 @@ VOICE_CONFIGS = {
     "priya_default": "Priya speaks in a warm, respectful tone suitable for Sanskrit conversation while ensuring proper halant pronunciations and clear consonant clusters, with a feminine voice quality."
 }
 
+def resolve_voice_key(voice_key: str) -> str:
+    """Unknown voices fall back to aryan_default"""
+    return voice_key if voice_key in VOICE_CONFIGS else "aryan_default"
+
 # ADD THIS FUNCTION HERE (before the class)
 def estimate_audio_duration(text: str, sampling_rate: int = 44100) -> float:
     """Estimate audio duration based on text length"""
@@ -44,11 +105,1605 @@ def estimate_audio_duration(text: str, sampling_rate: int = 44100) -> float:
     estimated_seconds = char_count / 2.5
     return max(1.0, estimated_seconds)
 
+# Streamer step policies. "fixed" decodes every play_steps_in_s of tokens, as before.
+# "adaptive" makes the first emission ADAPTIVE_FIRST_STEP_S long, then sizes each next
+# emission so generating it takes at most PLAY_STEPS_HEADROOM of the audio the client
+# has buffered ahead of playback, at most doubling per step, up to ADAPTIVE_MAX_STEP_S.
+PLAY_STEPS_POLICIES = ("fixed", "adaptive")
+STREAM_DEFAULT_PLAY_STEPS_POLICY = "adaptive"
+ADAPTIVE_FIRST_STEP_S = 0.2
+ADAPTIVE_MAX_STEP_S = 2.0
+PLAY_STEPS_HEADROOM = 0.5
+
+# Text chunking. Boundaries are scored by strength (sentence > clause > bare word break):
+# a chunk costs CHUNK_COST plus the penalty of the boundary it ends on, plus the squared
+# distance of its length from the balanced target, and the cheapest plan wins
+CHUNK_MAX_WORDS = 20
+CHUNK_COST = 100
+CHUNK_BREAK_PENALTY = {"sentence": 0, "clause": 40, "word": 1000}
+# Stream chunk plans: "small_first" cuts a first chunk of at most FIRST_CHUNK_MAX_WORDS
+# (at a natural boundary where there is one) so first audio needs only a tiny generate;
+# later chunks use the full CHUNK_MAX_WORDS. "uniform" treats every chunk alike.
+CHUNK_PLANS = ("uniform", "small_first")
+STREAM_DEFAULT_CHUNK_PLAN = "small_first"
+FIRST_CHUNK_MAX_WORDS = 4
+# Danda, double danda, "|" / "||" as ASCII stand-ins, Latin sentence punctuation
+SENTENCE_END_RE = re.compile(r"[।॥|.?!]+[\"'”’)\]]*$")
+CLAUSE_END_RE = re.compile(r"[,;:–—]+[\"'”’)\]]*$")
+# Punctuation-only tokens (a spaced-out danda, a dash) belong to the previous word, and so
+# does a verse number right after a danda ("॥ १ ॥"). Other numbers are words of their own.
+PUNCTUATION_TOKEN_RE = re.compile(r"^[\W_]+$")
+VERSE_NUMBER_RE = re.compile(r"^[।॥|]*[\d०-९]+[।॥|]*$")
+
+# Incremental text sessions (tts_begin / tts_append_text / tts_end): silence appended
+# after each chunk but the last, standing in for the pause a whole-text stream gets
+# between its chunks, and how many released chunks may be synthesizing ahead of playback
+SESSION_CHUNK_GAP_S = 0.1
+SESSION_LOOKAHEAD_CHUNKS = 1
+
+# Upper bound on rows per batched generate call (L4 memory)
+MAX_BATCH_CHUNKS = 8
+
+# Text chunks whose generation may run ahead of the chunk currently streaming
+STREAM_LOOKAHEAD_CHUNKS = 1
+
+# Wire formats for stream_synthesis audio frames
+#   wav - one self-contained WAV file per frame (original behaviour)
+#   pcm - format sent once in stream_start, then headerless little-endian PCM frames
+#   opus - one continuous Ogg/Opus stream, sent as pages while generation runs
+AUDIO_FORMATS = ("wav", "pcm", "opus")
+
+# Rates libopus can encode at, and what we send when the client doesn't ask
+OPUS_SAMPLE_RATES = (8000, 12000, 16000, 24000, 48000)
+OPUS_DEFAULT_SAMPLE_RATE = 48000
+OPUS_BIT_RATE = 24000
+# Ogg page duration in microseconds - short pages keep first-audio latency low
+OPUS_PAGE_DURATION_US = 20000
+
+# Sample formats clients may ask for, and the output sample rates we accept
+SAMPLE_FORMATS = ("f32", "s16")
+MIN_SAMPLE_RATE = 8000
+MAX_SAMPLE_RATE = 48000
+
+# Server-generated request ids are this many ASCII characters; tagged binary
+# frames lead with exactly these bytes
+REQUEST_ID_LENGTH = 8
+
+# tts_cancellations maps request_id -> when it was cancelled. A TTS container's watcher
+# thread looks up its live streams this often (off the generate and frame paths: each
+# lookup is a network round trip). Entries older than CANCELLATION_TTL_S - longer than a
+# cold start, so a request cancelled while its container starts still sees it - are
+# ignored, and deleted every CANCELLATION_PRUNE_INTERVAL_S.
+CANCEL_POLL_INTERVAL_S = 0.1
+CANCELLATION_TTL_S = 300
+CANCELLATION_PRUNE_INTERVAL_S = 60
+
+# Messages buffered per websocket connection before stream tasks wait on the writer
+OUTBOX_MAX_MESSAGES = 256
+
+# tts_gateway: the Fly server's /fly control socket and every browser's audio socket
+# must meet in one container, so it runs a single container with this many sockets
+GATEWAY_MAX_CONNECTIONS = 500
+# How long a tts_request waits for its client's audio socket before it is rejected
+GATEWAY_CLIENT_CONNECT_TIMEOUT_S = 5.0
+
+# Sampling settings shared by every generate call; part of the audio cache key
+SAMPLING_CONFIG = {"do_sample": True, "temperature": 1.0}
+
+# Service-wide deterministic mode: requests without a seed get DETERMINISTIC_DEFAULT_SEED,
+# and cuDNN autotuning is swapped for deterministic kernels. Seeded requests give up the
+# speed-ups whose effect on the audio depends on timing or on what the service has
+# learned so far: small_first chunking, adaptive play_steps, early stopping and silence
+# trimming, and learned token budgets (see seeded_stream_options)
+DETERMINISTIC_MODE = False
+DETERMINISTIC_DEFAULT_SEED = 0
+
+# Synthesized-audio cache: memory tier budget, and the disk tier on the tts-files volume.
+# Bump AUDIO_CACHE_VERSION whenever model, chunking or sampling changes alter the audio.
+AUDIO_CACHE_VERSION = 9
+AUDIO_CACHE_MEMORY_BYTES = 256 * 1024 * 1024
+AUDIO_CACHE_DIR = "/output/audio_cache"
+# Every AUDIO_CACHE_COMMIT_INTERVAL_S a container commits its new entries and reloads
+# the volume to see other containers' entries. Every AUDIO_CACHE_PRUNE_INTERVAL_S it
+# deletes disk entries unused for AUDIO_CACHE_DISK_TTL_S, then the least recently used
+# ones until the disk tier fits in AUDIO_CACHE_DISK_BYTES.
+AUDIO_CACHE_COMMIT_INTERVAL_S = 60
+AUDIO_CACHE_PRUNE_INTERVAL_S = 600
+AUDIO_CACHE_DISK_BYTES = 20 * 1024 * 1024 * 1024
+AUDIO_CACHE_DISK_TTL_S = 30 * 24 * 3600
+# Disk writes waiting for the cache thread; past this, new entries stay memory-only
+AUDIO_CACHE_WRITE_QUEUE = 256
+
+# How often a TTS container republishes its counters to tts_service_stats, and
+# how old an entry can be before the health check treats its container as gone
+STATS_PUBLISH_INTERVAL_S = 5
+STATS_STALE_AFTER_S = 900
+
+# How long the scheduler holds the first queued chunk waiting for others to batch with
+BATCH_WINDOW_MS = 20
+
+# Shape buckets for the compiled forward: prompt and description tokens are left-padded
+# up to the next bucket, batches are padded with repeat rows up to a batch bucket, and
+# the token budget is rounded up to one, so steady-state traffic only ever presents
+# these shapes (and never triggers a recompile). The static KV cache of each batch x
+# description bucket is allocated once, for the longest prompt and budget (see _generate)
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8)
+PROMPT_LENGTH_BUCKETS = (16, 32, 64, 128, 256)
+DESCRIPTION_LENGTH_BUCKETS = (32, 64, 128)
+TOKEN_BUDGET_BUCKETS = (128, 256, 512, 1024, 2000)
+
+# Calibrated token budget: once a voice/script has TOKEN_BUDGET_MIN_SAMPLES clean
+# generations, max_new_tokens = units * (mean + STD_MARGIN * std) * (1 + SAFETY_MARGIN)
+# tokens per unit, instead of words * token_per_word
+TOKEN_BUDGET_MIN_SAMPLES = 20
+TOKEN_BUDGET_STD_MARGIN = 3.0
+TOKEN_BUDGET_SAFETY_MARGIN = 0.1
+MIN_TOKEN_BUDGET = 50
+MAX_TOKEN_BUDGET = 2000
+
+# Early stopping. Streaming watches decoded audio energy and stops a generation once
+# it has been silent for SILENCE_STOP_S, but only after SILENCE_MIN_EXPECTED_FRACTION
+# of the expected tokens (so a mid-sentence pause doesn't cut it). Both paths stop a
+# generation that runs past RUNAWAY_TOKEN_FACTOR x the expected tokens, and trim
+# trailing silence down to TRAILING_SILENCE_KEEP_S before audio is sent.
+EARLY_STOPPING = True
+SILENCE_THRESHOLD_DB = -45.0
+SILENCE_FRAME_MS = 20
+SILENCE_STOP_S = 1.0
+SILENCE_MIN_EXPECTED_FRACTION = 0.6
+RUNAWAY_TOKEN_FACTOR = 1.5
+TRAILING_SILENCE_KEEP_S = 0.05
+
+# Startup warmup: load_model synthesizes WARMUP_TEXT for every voice through the batch
+# and stream paths, then runs WARMUP_DECODE_STEPS decoding steps for each shape in
+# warmup_shapes - the WARMUP_MAX_SHAPES shapes the fleet has served most, or every
+# bucket before there is any traffic - so lazy CUDA init, cuDNN autotuning and
+# compilation happen before the first request
+WARMUP_ON_START = True
+WARMUP_TEXT = "नमस्ते। संस्कृतं पठामः।"
+WARMUP_DECODE_STEPS = 4
+WARMUP_MAX_SHAPES = 16
+# Graphs dynamo may keep per compiled function before falling back to eager (its
+# default of 8 is less than one batch bucket needs): a prefill graph per batch x prompt
+# x description bucket, a decode graph per batch x description bucket, and slack
+DYNAMO_CACHE_SIZE_LIMIT = 2 * len(BATCH_SIZE_BUCKETS) * len(DESCRIPTION_LENGTH_BUCKETS) * (len(PROMPT_LENGTH_BUCKETS) + 1)
+
+def warmup_shapes(description_buckets: list, served_shapes: dict = None) -> list:
+    """(batch, prompt length, description length) shapes for warmup to compile.
+
+    served_shapes maps "batch x prompt x description x budget" to a call count, as
+    in CompileEventCounter.stats() summed over containers; the WARMUP_MAX_SHAPES most
+    served on-bucket shapes are warmed, or the whole grid when there are none. The
+    token budget is not part of a shape: each batch x description bucket's static
+    cache is allocated once, at the longest prompt, which is why that shape leads
+    its group here."""
+    grid = {
+        (rows, prompt_length, description_length)
+        for rows in BATCH_SIZE_BUCKETS for prompt_length in PROMPT_LENGTH_BUCKETS
+        for description_length in description_buckets
+    }
+    counts = {}
+    for key, count in (served_shapes or {}).items():
+        rows, prompt_length, description_length, _ = (int(part) for part in key.split("x"))
+        if (rows, prompt_length, description_length) in grid:
+            shape = (rows, prompt_length, description_length)
+            counts[shape] = counts.get(shape, 0) + count
+    shapes = set(sorted(counts, key=counts.get, reverse=True)[:WARMUP_MAX_SHAPES]) if counts else grid
+    shapes |= {(rows, PROMPT_LENGTH_BUCKETS[-1], description_length) for rows, _, description_length in shapes}
+    return sorted(shapes, key=lambda shape: (shape[0], shape[2], -shape[1]))
+
+
+def bucket_length(length: int, buckets: tuple) -> int:
+    """Smallest bucket >= length; past the last bucket, the next multiple of it"""
+    for bucket in buckets:
+        if length <= bucket:
+            return bucket
+    return -(-length // buckets[-1]) * buckets[-1]
+
+
+def left_pad_tokens(input_ids, attention_mask, length: int, pad_token_id: int):
+    """Left-pad a tokenized batch to exactly length positions (matches padding_side="left")"""
+    import torch.nn.functional as F
+
+    pad = length - input_ids.shape[-1]
+    if pad <= 0:
+        return input_ids, attention_mask
+    return F.pad(input_ids, (pad, 0), value=pad_token_id), F.pad(attention_mask, (pad, 0), value=0)
+
+
+def validate_output_format(sample_format, sample_rate, audio_format: str = "wav"):
+    """Returns an error message for an unsupported sample_format/sample_rate, else None"""
+    if audio_format == "opus" and sample_rate is not None and sample_rate not in OPUS_SAMPLE_RATES:
+        return f"Opus sample_rate must be one of {list(OPUS_SAMPLE_RATES)}"
+    if sample_format is not None and sample_format not in SAMPLE_FORMATS:
+        return f"Unsupported sample_format '{sample_format}', expected one of {list(SAMPLE_FORMATS)}"
+    if sample_rate is not None and (
+        not isinstance(sample_rate, int) or not MIN_SAMPLE_RATE <= sample_rate <= MAX_SAMPLE_RATE
+    ):
+        return f"sample_rate must be an integer between {MIN_SAMPLE_RATE} and {MAX_SAMPLE_RATE}"
+    return None
+
+
+def parse_stream_options(data: dict):
+    """(options, None) for a valid stream_tts / tts_begin / tts_request message, else (None, error message)"""
+    voice = data.get("voice", "aryan_default")
+    play_steps_in_s = data.get("play_steps_in_s", 0.5)
+    # audio_codec: "opus" is accepted as an alias for audio_format: "opus"
+    audio_format = data.get("audio_codec") or data.get("audio_format", "wav")
+    sample_format = data.get("sample_format")
+    sample_rate = data.get("sample_rate")
+    tagged_frames = bool(data.get("tagged_frames", False))
+    seed = data.get("seed")
+    chunk_plan = data.get("chunk_plan", STREAM_DEFAULT_CHUNK_PLAN)
+    play_steps_policy = data.get("play_steps_policy", STREAM_DEFAULT_PLAY_STEPS_POLICY)
+
+    if audio_format not in AUDIO_FORMATS:
+        return None, f"Unsupported audio_format '{audio_format}', expected one of {list(AUDIO_FORMATS)}"
+
+    format_error = validate_output_format(sample_format, sample_rate, audio_format)
+    if format_error:
+        return None, format_error
+
+    if seed is not None and (not isinstance(seed, int) or isinstance(seed, bool) or seed < 0):
+        return None, "seed must be a non-negative integer"
+
+    if chunk_plan not in CHUNK_PLANS:
+        return None, f"chunk_plan must be one of {', '.join(CHUNK_PLANS)}"
+
+    if play_steps_policy not in PLAY_STEPS_POLICIES:
+        return None, f"play_steps_policy must be one of {', '.join(PLAY_STEPS_POLICIES)}"
+
+    # What the service will run, so stream_start reports the chunk plan actually used
+    chunk_plan, play_steps_policy = seeded_stream_options(
+        DETERMINISTIC_DEFAULT_SEED if seed is None and DETERMINISTIC_MODE else seed, chunk_plan, play_steps_policy
+    )
+
+    return {
+        "voice": voice,
+        "play_steps_in_s": play_steps_in_s,
+        "audio_format": audio_format,
+        "sample_format": sample_format,
+        "sample_rate": sample_rate,
+        "tagged_frames": tagged_frames,
+        "seed": seed,
+        "chunk_plan": chunk_plan,
+        "play_steps_policy": play_steps_policy,
+    }, None
+
+
+def quantize_audio(audio, sample_format: str):
+    """float32 samples in [-1, 1] -> little-endian array of sample_format"""
+    import numpy as np
+
+    if sample_format == "s16":
+        return np.rint(np.clip(audio, -1.0, 1.0) * 32767.0).astype("<i2")
+    return np.ascontiguousarray(audio, dtype="<f4")
+
+
+def resample_audio(audio, source_rate: int, target_rate: int):
+    """One-shot polyphase resample of a complete signal"""
+    import numpy as np
+    from math import gcd
+    from scipy.signal import resample_poly
+
+    if source_rate == target_rate:
+        return audio
+    g = gcd(source_rate, target_rate)
+    return resample_poly(audio, target_rate // g, source_rate // g).astype(np.float32)
+
+
+class StreamingResampler:
+    """Polyphase resampler that can be fed one block at a time.
+
+    resample_poly is zero-phase, so every output sample needs `pad` input samples
+    of context on both sides. We keep that much history, hold back output until
+    its right-hand context has arrived, and emit the rest on flush(). Blocks
+    therefore join without the edge clicks that per-block resampling causes.
+    """
+
+    def __init__(self, source_rate: int, target_rate: int):
+        from math import gcd
+
+        g = gcd(source_rate, target_rate)
+        self.up = target_rate // g
+        self.down = source_rate // g
+        # resample_poly's default Kaiser window spans 10 * max(up, down) taps
+        # either side in the upsampled domain
+        self.pad = -(-10 * max(self.up, self.down) // self.up) + 1
+        self.buffer = None
+        self.buffer_start = 0  # Absolute input index of buffer[0], always a multiple of down
+        self.next_out = 0      # Absolute index of the next output sample to emit
+
+    def _emit(self, out_end: int):
+        import numpy as np
+        from scipy.signal import resample_poly
+
+        if out_end <= self.next_out:
+            return np.zeros(0, dtype=np.float32)
+        resampled = resample_poly(self.buffer, self.up, self.down)
+        offset = self.buffer_start * self.up // self.down
+        out = resampled[self.next_out - offset:out_end - offset].astype(np.float32)
+        self.next_out += len(out)
+
+        # Drop input no longer needed as left context, keeping buffer_start aligned to down
+        keep_from = (self.next_out * self.down) // self.up - self.pad
+        new_start = max(self.buffer_start, (keep_from // self.down) * self.down)
+        self.buffer = self.buffer[new_start - self.buffer_start:]
+        self.buffer_start = new_start
+        return out
+
+    def process(self, audio):
+        import numpy as np
+
+        audio = np.asarray(audio, dtype=np.float32)
+        self.buffer = audio if self.buffer is None else np.concatenate([self.buffer, audio])
+        total_in = self.buffer_start + len(self.buffer)
+        return self._emit(max(0, (total_in - self.pad) * self.up // self.down))
+
+    def flush(self):
+        import numpy as np
+
+        if self.buffer is None:
+            return np.zeros(0, dtype=np.float32)
+        total_in = self.buffer_start + len(self.buffer)
+        return self._emit(-(-total_in * self.up // self.down))
+
+
+class _ByteSink:
+    """Write-only file object the Ogg muxer writes into; drained after every encode"""
+
+    def __init__(self):
+        self.parts = []
+
+    def write(self, data) -> int:
+        self.parts.append(bytes(data))
+        return len(data)
+
+    def seekable(self) -> bool:
+        return False
+
+    def drain(self) -> bytes:
+        data = b"".join(self.parts)
+        self.parts = []
+        return data
+
+
+class OggOpusEncoder:
+    """One Ogg/Opus stream per request. Encoder and muxer state persist across
+    chunks, so the stream has a single header and no per-chunk container."""
+
+    def __init__(self, sample_rate: int, bit_rate: int = OPUS_BIT_RATE):
+        import av
+
+        self.sample_rate = sample_rate
+        self.sink = _ByteSink()
+        self.container = av.open(
+            self.sink, mode="w", format="ogg",
+            options={"page_duration": str(OPUS_PAGE_DURATION_US), "flush_packets": "1"},
+        )
+        self.stream = self.container.add_stream("libopus", rate=sample_rate)
+        self.stream.layout = "mono"
+        self.stream.bit_rate = bit_rate
+        self.pts = 0
+        self.closed = False
+
+    def encode(self, samples) -> bytes:
+        """samples: little-endian int16 mono"""
+        import av
+
+        frame = av.AudioFrame.from_ndarray(samples.reshape(1, -1), format="s16", layout="mono")
+        frame.sample_rate = self.sample_rate
+        frame.pts = self.pts
+        self.pts += samples.shape[0]
+        for packet in self.stream.encode(frame):
+            self.container.mux(packet)
+        return self.sink.drain()
+
+    def close(self) -> bytes:
+        if self.closed:
+            return b""
+        self.closed = True
+        for packet in self.stream.encode(None):
+            self.container.mux(packet)
+        self.container.close()
+        return self.sink.drain()
+
+
+class AudioStreamEncoder:
+    """Turns float32 sample blocks from the model into wire frames for one request.
+
+    sample_format None means the format's historical default: 16-bit WAV
+    (what soundfile always wrote) and float32 for pcm. Opus is always fed
+    16-bit samples and defaults to 48 kHz.
+    """
+
+    def __init__(self, audio_format: str, sampling_rate: int,
+                 sample_format: str = None, sample_rate: int = None):
+        if audio_format not in AUDIO_FORMATS:
+            raise ValueError(f"Unsupported audio_format '{audio_format}', expected one of {AUDIO_FORMATS}")
+        error = validate_output_format(sample_format, sample_rate, audio_format)
+        if error:
+            raise ValueError(error)
+        self.audio_format = audio_format
+        self.source_rate = sampling_rate
+        self.opus = None
+        if audio_format == "opus":
+            self.sampling_rate = sample_rate or OPUS_DEFAULT_SAMPLE_RATE
+            self.sample_format = "s16"
+            self.opus = OggOpusEncoder(self.sampling_rate)
+        else:
+            self.sampling_rate = sample_rate or sampling_rate
+            self.sample_format = sample_format or ("s16" if audio_format == "wav" else "f32")
+        self.resampler = (
+            StreamingResampler(self.source_rate, self.sampling_rate)
+            if self.sampling_rate != self.source_rate else None
+        )
+
+    def stream_format(self) -> dict:
+        """Format descriptor the websocket server forwards in stream_start"""
+        if self.audio_format == "opus":
+            return {
+                "encoding": "ogg_opus",
+                "sample_rate": self.sampling_rate,
+                "channels": 1,
+                "bit_rate": OPUS_BIT_RATE,
+            }
+        encoding = "wav" if self.audio_format == "wav" else f"pcm_{self.sample_format}le"
+        return {
+            "encoding": encoding,
+            "sample_format": self.sample_format,
+            "sample_rate": self.sampling_rate,
+            "channels": 1,
+        }
+
+    def _pack(self, audio) -> bytes:
+        if len(audio) == 0:
+            return b""
+        samples = quantize_audio(audio, self.sample_format)
+        if self.opus is not None:
+            return self.opus.encode(samples)
+        if self.audio_format == "pcm":
+            # Straight from the numpy buffer - no container
+            return samples.tobytes()
+
+        import io
+        import soundfile as sf
+        buffer = io.BytesIO()
+        subtype = "PCM_16" if self.sample_format == "s16" else "FLOAT"
+        sf.write(buffer, samples, self.sampling_rate, format='WAV', subtype=subtype)
+        return buffer.getvalue()
+
+    def encode(self, audio) -> bytes:
+        if self.resampler is not None:
+            audio = self.resampler.process(audio)
+        return self._pack(audio)
+
+    def flush(self) -> bytes:
+        """Audio held back by the resampler (and the Opus trailer); call once after the last encode()"""
+        tail = b""
+        if self.resampler is not None:
+            tail = self._pack(self.resampler.flush())
+        if self.opus is not None:
+            tail += self.opus.close()
+        return tail
+
+
+def derive_chunk_seed(seed: int, chunk: str) -> int:
+    """Per-chunk seed from the request seed and the chunk text (not its position),
+    so a sentence gets the same audio wherever it appears - matching the chunk cache key"""
+    digest = hashlib.sha256(f"{seed}:{normalize_text(chunk)}".encode("utf-8")).digest()
+    return int.from_bytes(digest[:8], "little") & 0x7FFF_FFFF_FFFF_FFFF
+
+
+class SeededSamplingLogitsProcessor:
+    """Sampling from a dedicated torch.Generator instead of the global RNG.
+
+    Applies the same warpers as do_sample=True (temperature, then top_k, then
+    top_p, as transformers orders them) and adds Gumbel noise from its own
+    generator, so greedy decoding (do_sample=False) picks an exact draw from
+    the same distribution unseeded requests sample from. Concurrent
+    generations can't disturb each other's random stream. Duck-types
+    transformers.LogitsProcessor.
+    """
+
+    def __init__(self, seed: int, temperature: float, device: str, top_k: int = 0, top_p: float = 1.0):
+        import torch
+
+        self.temperature = temperature
+        self.top_k = top_k or 0
+        self.top_p = 1.0 if top_p is None else top_p
+        self.generator = torch.Generator(device=device)
+        self.generator.manual_seed(seed)
+
+    def __call__(self, input_ids, scores):
+        import torch
+
+        scores = scores.float() / self.temperature
+        if 0 < self.top_k < scores.shape[-1]:
+            kth_best = torch.topk(scores, self.top_k, dim=-1).values[..., -1:]
+            scores = scores.masked_fill(scores < kth_best, float("-inf"))
+        if self.top_p < 1.0:
+            sorted_scores, sorted_indices = torch.sort(scores, descending=False)
+            remove = sorted_scores.softmax(dim=-1).cumsum(dim=-1) <= (1 - self.top_p)
+            remove[..., -1:] = False  # Always keep the most likely token
+            scores = scores.masked_fill(remove.scatter(-1, sorted_indices, remove), float("-inf"))
+
+        uniform = torch.rand(scores.shape, generator=self.generator, device=scores.device, dtype=torch.float32)
+        gumbel = -torch.log(-torch.log(uniform.clamp_(1e-10, 1.0 - 1e-7)))
+        return scores + gumbel
+
+
+class CancelStoppingCriteria:
+    """Stopping criterion that ends generate on its next decoding step once
+    cancel_event is set. Duck-types transformers.StoppingCriteria."""
+
+    def __init__(self, cancel_event: Event):
+        self.cancel_event = cancel_event
+
+    def __call__(self, input_ids, scores, **kwargs):
+        import torch
+        return torch.full(
+            (input_ids.shape[0],), self.cancel_event.is_set(), dtype=torch.bool, device=input_ids.device
+        )
+
+
+class ColdStartProfiler:
+    """Wall time and peak host/device memory for each phase of load_model.
+
+    Host peak is the process high-water mark (ru_maxrss) at the end of the phase;
+    device peak is torch.cuda.max_memory_allocated, reset at the start of each phase.
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.phases = {}
+
+    @staticmethod
+    def _cuda():
+        # torch may not be imported yet (the first phase imports it)
+        torch = sys.modules.get("torch")
+        if torch is not None and torch.cuda.is_available() and torch.cuda.is_initialized():
+            return torch.cuda
+        return None
+
+    @contextmanager
+    def phase(self, name: str):
+        cuda = self._cuda()
+        if cuda is not None:
+            cuda.reset_peak_memory_stats()
+        phase_started = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - phase_started
+            cuda = self._cuda()
+            self.phases[name] = {
+                "seconds": round(elapsed, 3),
+                "peak_host_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+                "peak_device_mb": round(cuda.max_memory_allocated() / (1024 * 1024), 1) if cuda else 0.0,
+            }
+
+    def record(self) -> dict:
+        total = time.perf_counter() - self.started
+        dominant = max(self.phases, key=lambda name: self.phases[name]["seconds"]) if self.phases else None
+        return {
+            "total_s": round(total, 3),
+            "dominant_phase": dominant,
+            "phases": self.phases,
+        }
+
+
+class MaxStepsStoppingCriteria:
+    """Stops generate after a fixed number of decoding steps (warmup only needs the
+    shapes, not the audio). Duck-types transformers.StoppingCriteria."""
+
+    def __init__(self, max_steps: int):
+        self.max_steps = max_steps
+        self.steps = 0
+
+    def __call__(self, input_ids, scores, **kwargs):
+        import torch
+        self.steps += 1
+        return torch.full(
+            (input_ids.shape[0],), self.steps >= self.max_steps, dtype=torch.bool, device=input_ids.device
+        )
+
+
+def voiced_frames(audio, sampling_rate: int, threshold_db: float = SILENCE_THRESHOLD_DB):
+    """Per-frame (SILENCE_FRAME_MS) flags: True where the RMS is above threshold_db"""
+    import numpy as np
+
+    frame = max(1, sampling_rate * SILENCE_FRAME_MS // 1000)
+    n_frames = -(-len(audio) // frame)
+    padded = np.zeros(n_frames * frame, dtype=np.float32)
+    padded[:len(audio)] = audio
+    rms = np.sqrt(np.mean(padded.reshape(n_frames, frame) ** 2, axis=1))
+    return rms > 10 ** (threshold_db / 20)
+
+
+def trim_trailing_silence(audio, sampling_rate: int, keep_s: float = TRAILING_SILENCE_KEEP_S):
+    """Cut audio after its last voiced frame (plus keep_s). All-silent audio is returned as is."""
+    import numpy as np
+
+    voiced = np.flatnonzero(voiced_frames(audio, sampling_rate))
+    if len(voiced) == 0:
+        return audio
+    frame = max(1, sampling_rate * SILENCE_FRAME_MS // 1000)
+    end = (voiced[-1] + 1) * frame + int(keep_s * sampling_rate)
+    return audio[:min(len(audio), end)]
+
+
+class SilenceMonitor:
+    """Tracks how long decoded audio has been silent since the last voiced frame.
+    Fed by the streamer consumer, read by EarlyStoppingCriteria on the generate thread."""
+
+    def __init__(self, sampling_rate: int):
+        self.sampling_rate = sampling_rate
+        self.frame = max(1, sampling_rate * SILENCE_FRAME_MS // 1000)
+        self.heard_voice = False
+        self.silent_samples = 0
+
+    def observe(self, block) -> bool:
+        """Returns True if the whole block is silence after voiced audio"""
+        import numpy as np
+
+        voiced = np.flatnonzero(voiced_frames(block, self.sampling_rate))
+        if len(voiced):
+            self.heard_voice = True
+            self.silent_samples = max(0, len(block) - (voiced[-1] + 1) * self.frame)
+            return False
+        self.silent_samples += len(block)
+        return self.heard_voice
+
+    @property
+    def silent_s(self) -> float:
+        return self.silent_samples / self.sampling_rate if self.heard_voice else 0.0
+
+
+class EarlyStoppingCriteria:
+    """Stops runaway generation: past RUNAWAY_TOKEN_FACTOR x expected_tokens, or,
+    with a SilenceMonitor, after SILENCE_STOP_S of silence once enough tokens are out.
+    expected_tokens may be None (uncalibrated). Duck-types transformers.StoppingCriteria."""
+
+    def __init__(self, expected_tokens=None, monitor: SilenceMonitor = None):
+        self.expected_tokens = expected_tokens
+        self.monitor = monitor
+        self.steps = 0
+        self.reason = None
+
+    def _should_stop(self) -> bool:
+        expected = self.expected_tokens
+        if expected is not None and self.steps > expected * RUNAWAY_TOKEN_FACTOR:
+            self.reason = "runaway"
+        elif (
+            self.monitor is not None
+            and self.monitor.silent_s >= SILENCE_STOP_S
+            and (expected is None or self.steps >= expected * SILENCE_MIN_EXPECTED_FRACTION)
+        ):
+            self.reason = "silence"
+        return self.reason is not None
+
+    def __call__(self, input_ids, scores, **kwargs):
+        import torch
+        self.steps += 1
+        return torch.full(
+            (input_ids.shape[0],), self._should_stop(), dtype=torch.bool, device=input_ids.device
+        )
+
+
+def legacy_chunk_text(text: str, max_words: int = 20) -> list:
+    """The original regex chunker, kept for benchmark_chunker"""
+    words = text.split()
+    if len(words) <= max_words:
+        return [text]  # No chunking needed
+    
+    # Split by sentences first, using both markers
+    sentences = re.split(r'[।|\.]+', text)
+    chunks = []
+    current_chunk = ""
+    current_word_count = 0
+    
+    for sentence in sentences:
+        sentence = sentence.strip()
+        if not sentence:
+            continue
+            
+        sentence_words = len(sentence.split())
+        
+        # If adding this sentence exceeds word limit, save current chunk
+        if current_word_count + sentence_words > max_words and current_chunk:
+            chunks.append(current_chunk.strip())
+            current_chunk = sentence
+            current_word_count = sentence_words
+        else:
+            current_chunk += (" " + sentence if current_chunk else sentence)
+            current_word_count += sentence_words
+    
+    # Add final chunk
+    if current_chunk.strip():
+        chunks.append(current_chunk.strip())
+    
+    return chunks
+
+
+def attaches_to(previous: str, token: str) -> bool:
+    """Whether token closes the word before it rather than being a word itself"""
+    if PUNCTUATION_TOKEN_RE.match(token):
+        return True
+    return bool(VERSE_NUMBER_RE.match(token)) and previous.endswith(("।", "॥", "|"))
+
+
+def has_letters(text: str) -> bool:
+    return any(ch.isalpha() for ch in text)
+
+
+def split_words(text: str) -> list:
+    """Whitespace words, with attached tokens (see attaches_to) kept in the word
+    before them, spacing included - so len(split_words(chunk)) counts real words
+    and " ".join(words) gives back the text the model should read"""
+    words = []
+    for token in text.split():
+        if words and attaches_to(words[-1], token):
+            words[-1] += " " + token
+        else:
+            words.append(token)
+    return words
+
+
+def word_break(word: str) -> str:
+    """Strength of the boundary after word: sentence, clause or word"""
+    if SENTENCE_END_RE.search(word):
+        return "sentence"
+    if CLAUSE_END_RE.search(word):
+        return "clause"
+    return "word"
+
+
+def plan_chunks(words: list, max_words: int = CHUNK_MAX_WORDS, first_max_words: int = None) -> list:
+    """Cut words into chunks of at most max_words (first_max_words for the first one).
+
+    Dynamic program over cut positions: every chunk costs CHUNK_COST, plus the
+    penalty of the boundary it ends on, plus its squared distance from the
+    balanced chunk length. So it prefers the fewest chunks, cut at sentence
+    ends, then at clauses, with even sizes, and falls back to a bare word
+    break only when a sentence is longer than max_words.
+    A short first chunk ends at the last sentence end within first_max_words,
+    else the last clause mark, else takes all first_max_words words; the rest
+    is planned (and balanced) on its own.
+    Returns the (start, end) word spans.
+    """
+    max_words = max(1, max_words)
+    first_max_words = max(1, min(first_max_words or max_words, max_words))
+    n = len(words)
+    if n == 0:
+        return []
+    
+    if first_max_words < max_words and n > first_max_words:
+        first_len = first_max_words
+        for strength in ("sentence", "clause"):
+            cuts = [i + 1 for i, word in enumerate(words[:first_max_words]) if word_break(word) == strength]
+            if cuts:
+                first_len = cuts[-1]
+                break
+        rest = plan_chunks(words[first_len:], max_words)
+        return [(0, first_len)] + [(start + first_len, end + first_len) for start, end in rest]
+    
+    penalties = [CHUNK_BREAK_PENALTY[word_break(word)] for word in words]
+    penalties[-1] = 0  # End of text is always a clean cut
+    target = n / -(-n // max_words)
+    
+    best = [0.0] + [float("inf")] * n
+    cut_from = [0] * (n + 1)
+    for end in range(1, n + 1):
+        for start in range(max(0, end - max_words), end):
+            if best[start] == float("inf"):
+                continue
+            cost = best[start] + CHUNK_COST + penalties[end - 1] + (end - start - target) ** 2
+            if cost < best[end]:
+                best[end] = cost
+                cut_from[end] = start
+    
+    spans = []
+    end = n
+    while end > 0:
+        spans.append((cut_from[end], end))
+        end = cut_from[end]
+    return spans[::-1]
+
+
+def chunk_sanskrit_text(text: str, max_words: int = CHUNK_MAX_WORDS, first_max_words: int = None) -> list:
+    """Split text into TTS chunks of at most max_words words, at the strongest
+    boundaries available (danda / double danda / . ? !, then , ; :, then any word)"""
+    words = split_words(text)
+    if len(words) <= (first_max_words or max_words):
+        return [" ".join(words)] if words else []
+    return [" ".join(words[start:end]) for start, end in plan_chunks(words, max_words, first_max_words)]
+
+
+class IncrementalChunker:
+    """Chunker for text that arrives a piece at a time (LLM tokens).
+
+    append() returns the chunks that are ready: everything up to the last
+    sentence end within the word limit, or - when a sentence runs past the
+    limit - a chunk cut at the last clause mark in reach, else at the limit.
+    The first chunk is capped at first_max_words so the first audio is quick.
+    A word is complete once whitespace follows it. Every cut waits until the
+    next word with letters has started, so punctuation-only tokens that follow
+    (a spaced danda, "॥ १ ॥" verse numbers) stay with the chunk they close
+    instead of opening one of their own. flush() releases whatever is left.
+    """
+
+    def __init__(self, max_words: int = CHUNK_MAX_WORDS, first_max_words: int = None):
+        self.max_words = max(1, max_words)
+        self.first_max_words = max(1, min(first_max_words or self.max_words, self.max_words))
+        self.buffer = ""
+        self.released = 0
+
+    def _limit(self) -> int:
+        return self.first_max_words if self.released == 0 else self.max_words
+
+    def append(self, text: str) -> list:
+        self.buffer += text
+        head, tail = self.buffer, ""
+        if head and not head[-1].isspace():
+            parts = head.rsplit(None, 1)
+            head, tail = (parts[0] if len(parts) > 1 else ""), parts[-1]
+        words = split_words(head)
+        # split_words keeps attached tokens (punctuation, verse numbers) in the word
+        # before, so a complete word after a cut opens new text; the unfinished tail may not
+        next_word_started = bool(tail) and not (words and attaches_to(words[-1], tail))
+
+        chunks = []
+        while words:
+            limit = self._limit()
+            sentence_cuts = [
+                i + 1 for i, word in enumerate(words[:limit])
+                if word_break(word) == "sentence" and (i + 1 < len(words) or next_word_started)
+            ]
+            if sentence_cuts:
+                cut = sentence_cuts[-1]
+            elif len(words) > limit:
+                clause_cuts = [i + 1 for i, word in enumerate(words[:limit]) if word_break(word) == "clause"]
+                cut = clause_cuts[-1] if clause_cuts else limit
+            else:
+                break
+            chunks.append(" ".join(words[:cut]))
+            self.released += 1
+            words = words[cut:]
+
+        self.buffer = " ".join(words) + (" " if words else "") + tail
+        return chunks
+
+    def flush(self) -> list:
+        words = split_words(self.buffer)
+        self.buffer = ""
+        if not has_letters("".join(words)):
+            return []  # Nothing left to voice
+        first_max_words = self.first_max_words if self.released == 0 else None
+        chunks = [" ".join(words[start:end]) for start, end in plan_chunks(words, self.max_words, first_max_words)]
+        self.released += len(chunks)
+        return chunks
+
+
+def plan_text_chunks(text: str, chunk_plan: str = "uniform") -> list:
+    """Text chunks for a chunk plan (see CHUNK_PLANS)"""
+    first_max_words = FIRST_CHUNK_MAX_WORDS if chunk_plan == "small_first" else None
+    return chunk_sanskrit_text(text, CHUNK_MAX_WORDS, first_max_words)
+
+
+def seeded_stream_options(seed, chunk_plan: str, play_steps_policy: str):
+    """(chunk_plan, play_steps_policy) a stream actually runs with. A seeded stream
+    takes batch_synthesis's uniform chunks, so a seed gives the same audio on both
+    paths, and fixed play_steps: adaptive emission points follow wall-clock timing"""
+    if seed is None:
+        return chunk_plan, play_steps_policy
+    return "uniform", "fixed"
+
+
+def describe_chunk_plan(text: str, chunk_plan: str) -> dict:
+    """The chunk plan as reported to the client in stream_start"""
+    chunks = plan_text_chunks(text, chunk_plan)
+    return {
+        "name": chunk_plan,
+        "chunks": len(chunks),
+        "words_per_chunk": [len(split_words(chunk)) for chunk in chunks],
+    }
+
+
+def normalize_text(text: str) -> str:
+    """Canonical form of input text for cache keys: NFC, single spaces"""
+    return " ".join(unicodedata.normalize("NFC", text).split())
+
+
+class AudioCache:
+    """Content-addressed cache of synthesized audio (float32 at the model rate).
+
+    Memory tier is an LRU bounded by max_memory_bytes; the disk tier keeps one
+    .npy per key under disk_dir and survives container restarts. Disk hits are
+    promoted back into memory and touch the file, so its mtime is its last use
+    and prune_disk() can evict by age and LRU.
+    """
+
+    def __init__(self, disk_dir: str = None, max_memory_bytes: int = AUDIO_CACHE_MEMORY_BYTES):
+        self.disk_dir = disk_dir
+        self.max_memory_bytes = max_memory_bytes
+        self.entries = OrderedDict()
+        self.memory_bytes = 0
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.bytes_saved = 0
+        self.disk_bytes = None  # Known after the first prune_disk()
+        self.disk_evictions = 0
+        self.lock = Lock()
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+
+    @staticmethod
+    def make_key(text: str, voice_key: str, sampling: dict, seed=None, **extra) -> str:
+        payload = json.dumps({
+            "version": AUDIO_CACHE_VERSION,
+            "text": normalize_text(text),
+            "voice": voice_key,
+            "sampling": sampling,
+            "seed": seed,
+            **extra,
+        }, sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _disk_path(self, key: str) -> str:
+        return os.path.join(self.disk_dir, key[:2], f"{key}.npy")
+
+    def _remember(self, key: str, audio):
+        # Caller holds the lock
+        if key in self.entries:
+            self.memory_bytes -= self.entries.pop(key).nbytes
+        if audio.nbytes > self.max_memory_bytes:
+            return
+        self.entries[key] = audio
+        self.memory_bytes += audio.nbytes
+        while self.memory_bytes > self.max_memory_bytes:
+            _, evicted = self.entries.popitem(last=False)
+            self.memory_bytes -= evicted.nbytes
+
+    def get(self, key: str):
+        import numpy as np
+
+        with self.lock:
+            audio = self.entries.get(key)
+            if audio is not None:
+                self.entries.move_to_end(key)
+                self.memory_hits += 1
+                self.bytes_saved += audio.nbytes
+                return audio
+
+        if self.disk_dir:
+            path = self._disk_path(key)
+            try:
+                audio = np.load(path)
+            except (FileNotFoundError, ValueError, OSError):
+                audio = None
+            if audio is not None:
+                try:
+                    os.utime(path)
+                except OSError:
+                    pass
+                with self.lock:
+                    self._remember(key, audio)
+                    self.disk_hits += 1
+                    self.bytes_saved += audio.nbytes
+                return audio
+
+        with self.lock:
+            self.misses += 1
+        return None
+
+    def put(self, key: str, audio, write_disk: bool = True) -> bool:
+        """Returns True if the entry was newly written to disk"""
+        import numpy as np
+
+        audio = np.ascontiguousarray(audio, dtype=np.float32)
+        audio.setflags(write=False)  # Shared between requests
+        with self.lock:
+            self._remember(key, audio)
+        return self.write_disk(key, audio) if write_disk else False
+
+    def write_disk(self, key: str, audio) -> bool:
+        """Disk tier only; returns True if the entry was newly written"""
+        import numpy as np
+
+        if not self.disk_dir:
+            return False
+        path = self._disk_path(key)
+        if os.path.exists(path):
+            return False
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write-then-rename so a concurrent reader never sees a partial file
+        tmp_path = f"{path}.{uuid.uuid4().hex[:8]}.tmp"
+        with open(tmp_path, "wb") as f:
+            np.save(f, audio)
+        os.replace(tmp_path, path)
+        return True
+
+    def prune_disk(self, max_bytes: int = AUDIO_CACHE_DISK_BYTES, ttl_s: float = AUDIO_CACHE_DISK_TTL_S) -> int:
+        """Delete disk entries unused for ttl_s, then the least recently used until
+        the tier fits in max_bytes. Returns the number of files removed."""
+        if not self.disk_dir:
+            return 0
+        now = time.time()
+        files = []
+        for root, _, names in os.walk(self.disk_dir):
+            for name in names:
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:  # Pruned by another container meanwhile
+                    continue
+                files.append((stat.st_mtime, stat.st_size, path))
+        
+        files.sort()
+        total = sum(size for _, size, _ in files)
+        removed = 0
+        for mtime, size, path in files:
+            if now - mtime < ttl_s and total <= max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            removed += 1
+        
+        with self.lock:
+            self.disk_bytes = total
+            self.disk_evictions += removed
+        return removed
+
+    def stats(self) -> dict:
+        with self.lock:
+            lookups = self.memory_hits + self.disk_hits + self.misses
+            return {
+                "entries": len(self.entries),
+                "memory_bytes": self.memory_bytes,
+                "max_memory_bytes": self.max_memory_bytes,
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_ratio": (self.memory_hits + self.disk_hits) / lookups if lookups else 0.0,
+                "bytes_saved": self.bytes_saved,
+                "disk_bytes": self.disk_bytes,
+                "disk_evictions": self.disk_evictions,
+            }
+
+
+def summarize_service_stats(container_stats: list) -> dict:
+    """Roll the per-container entries of tts_service_stats up for health_response"""
+    now = time.time()
+    live = [stats for stats in container_stats if now - stats.get("updated_at", 0) < STATS_STALE_AFTER_S]
+    
+    hits = misses = bytes_saved = recompile_events = cudagraph_rerecord_events = 0
+    cold_starts = [stats["cold_start"] for stats in live if stats.get("cold_start")]
+    for stats in live:
+        cache = stats.get("audio_cache") or {}
+        hits += cache.get("memory_hits", 0) + cache.get("disk_hits", 0)
+        misses += cache.get("misses", 0)
+        bytes_saved += cache.get("bytes_saved", 0)
+        recompile_events += (stats.get("compile") or {}).get("recompile_events", 0)
+        cudagraph_rerecord_events += (stats.get("compile") or {}).get("cudagraph_rerecord_events", 0)
+    
+    return {
+        "containers": len(live),
+        "audio_cache": {
+            "hits": hits,
+            "misses": misses,
+            "hit_ratio": hits / (hits + misses) if hits + misses else 0.0,
+            "bytes_saved": bytes_saved,
+        },
+        # Should stay 0: steady-state traffic is meant to hit precompiled shapes only
+        "recompile_events": recompile_events,
+        "cudagraph_rerecord_events": cudagraph_rerecord_events,
+        "slowest_cold_start": max(cold_starts, key=lambda record: record["total_s"]) if cold_starts else None,
+        "per_container": live,
+    }
+
+
+class VoiceConditioningCache:
+    """Bounded LRU of tokenized + encoded voice descriptions, kept on device"""
+
+    def __init__(self, encode_fn, max_entries: int = 16):
+        self.encode_fn = encode_fn
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = Lock()
+
+    def get(self, key: str, description: str) -> dict:
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry["description"] == description:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry
+            self.misses += 1
+
+        # Encode outside the lock - it runs the text encoder on the GPU
+        entry = self.encode_fn(description)
+        entry["description"] = description
+
+        with self.lock:
+            self.entries[key] = entry
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        return entry
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                "entries": len(self.entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+
+class MicroBatchScheduler:
+    """Collects chunks from concurrent calls and runs them as batched generates.
+
+    Chunks queue for up to window_ms after the first arrives, are grouped by
+    voice and handed to run_batch(voice_key, chunks) in groups of max_batch.
+    Each caller gets one Future per chunk.
+    """
+
+    WAIT_BUCKETS_MS = (1, 5, 10, 20, 50, 100, 250, 500, 1000)
+
+    def __init__(self, run_batch, window_ms: float = BATCH_WINDOW_MS, max_batch: int = MAX_BATCH_CHUNKS):
+        self.run_batch = run_batch
+        self.window_s = window_ms / 1000
+        self.max_batch = max_batch
+        self.queue = queue.Queue()
+        self.lock = Lock()
+        self.wait_histogram = {bucket: 0 for bucket in self.WAIT_BUCKETS_MS + ("inf",)}
+        self.batch_size_histogram = {}
+        self.batches_run = 0
+        self.thread = Thread(target=self._run, daemon=True, name="tts-batch-scheduler")
+        self.thread.start()
+
+    def submit(self, voice_key: str, chunks: list) -> list:
+        futures = []
+        for chunk in chunks:
+            future = Future()
+            self.queue.put((voice_key, chunk, future, time.monotonic()))
+            futures.append(future)
+        return futures
+
+    def _collect(self) -> list:
+        pending = [self.queue.get()]
+        deadline = time.monotonic() + self.window_s
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                pending.append(self.queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return pending
+
+    def _record(self, batch: list, started: float):
+        with self.lock:
+            for _, _, _, enqueued in batch:
+                wait_ms = (started - enqueued) * 1000
+                bucket = next((b for b in self.WAIT_BUCKETS_MS if wait_ms <= b), "inf")
+                self.wait_histogram[bucket] += 1
+            self.batch_size_histogram[len(batch)] = self.batch_size_histogram.get(len(batch), 0) + 1
+            self.batches_run += 1
+
+    def _run(self):
+        logger = logging.getLogger(__name__)
+        while True:
+            by_voice = {}
+            for item in self._collect():
+                by_voice.setdefault(item[0], []).append(item)
+
+            for voice_key, items in by_voice.items():
+                for start in range(0, len(items), self.max_batch):
+                    batch = items[start:start + self.max_batch]
+                    self._record(batch, time.monotonic())
+                    try:
+                        audios = self.run_batch(voice_key, [chunk for _, chunk, _, _ in batch])
+                        for (_, _, future, _), audio in zip(batch, audios):
+                            future.set_result(audio)
+                    except Exception as e:
+                        logger.error(f"❌ Scheduler batch failed ({voice_key}, {len(batch)} chunks): {e}")
+                        for _, _, future, _ in batch:
+                            future.set_exception(e)
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                "window_ms": self.window_s * 1000,
+                "batches_run": self.batches_run,
+                "queue_depth": self.queue.qsize(),
+                "queue_wait_ms_histogram": {str(k): v for k, v in self.wait_histogram.items()},
+                "batch_size_histogram": dict(sorted(self.batch_size_histogram.items())),
+            }
+
+
+class AdaptivePlaySteps:
+    """Per-request streamer step sizes (in tokens) for the "adaptive" policy.
+
+    on_yield() is fed every block as it goes out, which gives how far the audio
+    sent is ahead of real-time playback; on_emission() is fed each streamer
+    decode, which gives the generation rate. Both run on different threads;
+    plain counters are enough here.
+    """
+
+    def __init__(self, frame_rate: float, sampling_rate: int):
+        self.frame_rate = frame_rate
+        self.sampling_rate = sampling_rate
+        self.min_tokens = max(1, int(ADAPTIVE_FIRST_STEP_S * frame_rate))
+        self.max_tokens = max(self.min_tokens, int(ADAPTIVE_MAX_STEP_S * frame_rate))
+        self.last_tokens = self.min_tokens
+        self.first_yield = None
+        self.yielded_samples = 0
+        self.generated_tokens = 0
+        self.generation_s = 0.0
+        self.schedule = []  # Emitted step sizes in seconds, one list per generated text chunk
+
+    def on_yield(self, samples: int):
+        if self.first_yield is None:
+            self.first_yield = time.perf_counter()
+        self.yielded_samples += samples
+
+    def on_emission(self, tokens: int, seconds: float):
+        self.generated_tokens += tokens
+        self.generation_s += seconds
+
+    def ahead_s(self) -> float:
+        if self.first_yield is None:
+            return 0.0
+        return self.yielded_samples / self.sampling_rate - (time.perf_counter() - self.first_yield)
+
+    def next_step_tokens(self) -> int:
+        if self.first_yield is None or self.generation_s <= 0:
+            return self.min_tokens
+        tokens_per_s = self.generated_tokens / self.generation_s
+        affordable = int(tokens_per_s * max(0.0, self.ahead_s()) * PLAY_STEPS_HEADROOM)
+        self.last_tokens = max(self.min_tokens, min(affordable, self.last_tokens * 2, self.max_tokens))
+        return self.last_tokens
+
+
+class CoalescedStream:
+    """One in-flight generation's raw audio blocks, fanned out to every identical request.
+
+    The producer appends blocks to a log and never waits on a subscriber; each
+    subscriber reads the log at its own pace, so a late joiner replays the blocks
+    already sent and then follows live ones. When the last subscriber detaches
+    before the end, cancel_event stops the generation.
+    """
+
+    def __init__(self, key: str):
+        self.key = key
+        self.blocks = []
+        self.done = False
+        self.result = {"complete": False}
+        self.subscribers = 0
+        self.cancel_event = Event()
+        self.condition = Condition()
+
+    def attach(self):
+        """Subscribe; returns the number of blocks that will be replayed, or None if
+        this stream can no longer serve a full response (cancelled or failed)."""
+        with self.condition:
+            if self.cancel_event.is_set() or (self.done and not self.result["complete"]):
+                return None
+            self.subscribers += 1
+            return len(self.blocks)
+
+    def detach(self):
+        with self.condition:
+            self.subscribers -= 1
+            if self.subscribers == 0 and not self.done:
+                self.cancel_event.set()
+
+    def publish(self, block):
+        with self.condition:
+            self.blocks.append(block)
+            self.condition.notify_all()
+
+    def finish(self, result: dict):
+        with self.condition:
+            self.result = result
+            self.done = True
+            self.condition.notify_all()
+
+    def wake(self):
+        """Let followers re-check their stop event"""
+        with self.condition:
+            self.condition.notify_all()
+
+    def follow(self, stop: Event = None):
+        """The blocks in order, from the first; ends early once stop is set (and wake() called)"""
+        index = 0
+        while True:
+            with self.condition:
+                while index >= len(self.blocks) and not self.done and not (stop and stop.is_set()):
+                    self.condition.wait()
+                if stop and stop.is_set():
+                    return
+                available = self.blocks[index:]
+                done = self.done
+            index += len(available)
+            yield from available
+            if done:
+                return
+
+    def __iter__(self):
+        return self.follow()
+
+
+def count_aksharas(text: str) -> int:
+    """Devanagari syllables: independent vowels plus consonants that don't follow a virama
+    (a conjunct like क्ष counts once)"""
+    count = 0
+    after_virama = False
+    for ch in text:
+        cp = ord(ch)
+        if 0x0904 <= cp <= 0x0914 or 0x0960 <= cp <= 0x0961:
+            count += 1
+        elif (0x0915 <= cp <= 0x0939 or 0x0958 <= cp <= 0x095F) and not after_virama:
+            count += 1
+        after_virama = cp == 0x094D
+    return count
+
+
+def detect_script(text: str) -> str:
+    """Dominant script of the letters in text: devanagari, latin or other"""
+    counts = {}
+    for ch in text:
+        if ch.isalpha() or unicodedata.category(ch) in ("Mn", "Mc"):
+            script = unicodedata.name(ch, "OTHER").split(" ")[0].lower()
+            counts[script] = counts.get(script, 0) + 1
+    if not counts:
+        return "other"
+    script = max(counts, key=counts.get)
+    return script if script in ("devanagari", "latin") else "other"
+
+
+class TokenBudgetEstimator:
+    """Learns generated audio tokens per text unit, per voice and script.
+
+    The unit is the akshara for Devanagari and the word otherwise. Each clean
+    generation (one that ended before its budget) updates a running mean and
+    variance (Welford); generations that hit the cap are counted, not learned from.
+    Local updates are merged into tts_token_budget by publish(), and load() pulls
+    what other containers have learned.
+    """
+
+    def __init__(self, fallback_tokens_per_word: int):
+        self.fallback_tokens_per_word = fallback_tokens_per_word
+        self.lock = Lock()
+        self.models = {}    # "voice:script" -> {"count", "mean", "m2"}
+        self.pending = {}   # Same shape: learned here since the last publish
+        self.report = {
+            "chunks": 0,
+            "calibrated_chunks": 0,
+            "cap_hits": 0,
+            "legacy_budget_tokens": 0,
+            "budget_tokens": 0,
+            "generated_tokens": 0,
+        }
+
+    @staticmethod
+    def features(text: str, voice_key: str):
+        script = detect_script(text)
+        units = count_aksharas(text) if script == "devanagari" else len(text.split())
+        return f"{resolve_voice_key(voice_key)}:{script}", max(1, units)
+
+    @staticmethod
+    def _combine(a: dict, b: dict) -> dict:
+        """Merge two Welford accumulators"""
+        count = a["count"] + b["count"]
+        if count == 0:
+            return {"count": 0, "mean": 0.0, "m2": 0.0}
+        delta = b["mean"] - a["mean"]
+        return {
+            "count": count,
+            "mean": a["mean"] + delta * b["count"] / count,
+            "m2": a["m2"] + b["m2"] + delta * delta * a["count"] * b["count"] / count,
+        }
+
+    def legacy_budget(self, text: str) -> int:
+        """The old words * token_per_word estimate"""
+        return max(MIN_TOKEN_BUDGET, min(len(text.split()) * self.fallback_tokens_per_word, MAX_TOKEN_BUDGET))
+
+    def budget(self, text: str, voice_key: str):
+        """Token budget for text, and whether it came from a calibrated model"""
+        key, units = self.features(text, voice_key)
+        with self.lock:
+            model = self.models.get(key)
+            if model is None or model["count"] < TOKEN_BUDGET_MIN_SAMPLES:
+                return self.legacy_budget(text), False
+            std = (model["m2"] / (model["count"] - 1)) ** 0.5
+            per_unit = (model["mean"] + TOKEN_BUDGET_STD_MARGIN * std) * (1 + TOKEN_BUDGET_SAFETY_MARGIN)
+        return max(MIN_TOKEN_BUDGET, min(int(units * per_unit) + 1, MAX_TOKEN_BUDGET)), True
+
+    def expected(self, text: str, voice_key: str):
+        """Mean expected tokens for text, or None while uncalibrated"""
+        key, units = self.features(text, voice_key)
+        with self.lock:
+            model = self.models.get(key)
+            if model is None or model["count"] < TOKEN_BUDGET_MIN_SAMPLES:
+                return None
+            return units * model["mean"]
+
+    def record(self, text: str, voice_key: str, budget_tokens: int, generated_tokens: int, calibrated: bool,
+               censored: bool = False):
+        """censored: the generation was cut off (hit max_new_tokens or a runaway stop)"""
+        key, units = self.features(text, voice_key)
+        legacy = bucket_length(self.legacy_budget(text), TOKEN_BUDGET_BUCKETS)
+        with self.lock:
+            self.report["chunks"] += 1
+            self.report["calibrated_chunks"] += calibrated
+            self.report["legacy_budget_tokens"] += legacy
+            self.report["budget_tokens"] += budget_tokens
+            self.report["generated_tokens"] += generated_tokens
+            if censored:
+                # Cut off by the cap or a runaway stop: the true length is unknown, so don't learn from it
+                self.report["cap_hits"] += 1
+                return
+            sample = {"count": 1, "mean": generated_tokens / units, "m2": 0.0}
+            empty = {"count": 0, "mean": 0.0, "m2": 0.0}
+            self.models[key] = self._combine(self.models.get(key, empty), sample)
+            self.pending[key] = self._combine(self.pending.get(key, empty), sample)
+
+    def load(self, store):
+        for key, model in store.items():
+            with self.lock:
+                # Keep anything learned locally before the load on top of the shared model
+                local = self.pending.get(key)
+                self.models[key] = self._combine(model, local) if local else dict(model)
+
+    def publish(self, store):
+        """Merge local updates into the shared statistics (last writer wins on a race)"""
+        with self.lock:
+            pending, self.pending = self.pending, {}
+        for key, delta in pending.items():
+            shared = store.get(key) or {"count": 0, "mean": 0.0, "m2": 0.0}
+            merged = self._combine(shared, delta)
+            store.put(key, merged)
+            with self.lock:
+                local_since = self.pending.get(key)
+                self.models[key] = self._combine(merged, local_since) if local_since else merged
+
+    def stats(self) -> dict:
+        with self.lock:
+            report = dict(self.report)
+            models = {
+                key: {
+                    "samples": model["count"],
+                    "tokens_per_unit": round(model["mean"], 2),
+                    "std": round((model["m2"] / (model["count"] - 1)) ** 0.5, 2) if model["count"] > 1 else None,
+                }
+                for key, model in sorted(self.models.items())
+            }
+        report["over_allocation_removed_tokens"] = report["legacy_budget_tokens"] - report["budget_tokens"]
+        report["over_allocation_remaining_tokens"] = report["budget_tokens"] - report["generated_tokens"]
+        report["models"] = models
+        return report
+
+
+class CompileEventCounter:
+    """Counts torch.compile graph compilations, CUDA graph re-records and the input
+    shapes generate sees.
+
+    Compilations are read from dynamo's unique_graphs counter after each generate,
+    CUDA graph events from inductor's re-record (non-static inputs) and skip
+    counters. Anything compiled or re-recorded after mark_steady_state() is live
+    traffic paying for a graph the shape buckets are meant to rule out.
+    """
+
+    def __init__(self):
+        self.lock = Lock()
+        self.steady_since = None
+        self.graphs_at_steady = 0
+        self.graphs_seen = 0
+        self.recompile_events = 0
+        self.cudagraph_seen = 0
+        self.cudagraph_events = 0
+        self.warmed_shapes = set()
+        # Shapes of live traffic only, so warmup_shapes isn't fed back what warmup ran
+        self.shapes = {}
+        self.new_shapes_after_steady = 0
+
+    @staticmethod
+    def _compiled_graphs() -> int:
+        try:
+            from torch._dynamo.utils import counters
+            return counters["stats"]["unique_graphs"]
+        except Exception:
+            return 0
+
+    @staticmethod
+    def _cudagraph_rerecords() -> int:
+        """CUDA graphs recorded again for new input addresses, plus calls that fell
+        back to no CUDA graph (each replays eagerly instead of from a graph)"""
+        try:
+            from torch._dynamo.utils import counters
+            return (counters["inductor"]["cudagraph_recorded_non_static_inputs"]
+                    + counters["inductor"]["cudagraph_skips"])
+        except Exception:
+            return 0
+
+    def mark_steady_state(self):
+        with self.lock:
+            self.graphs_seen = self.graphs_at_steady = self._compiled_graphs()
+            self.cudagraph_seen = self._cudagraph_rerecords()
+            self.steady_since = time.time()
+
+    def observe(self, shape: tuple, request_id: str):
+        """Record one generate call's (batch, prompt, description, budget) shape"""
+        graphs = self._compiled_graphs()
+        rerecords = self._cudagraph_rerecords()
+        with self.lock:
+            new_graphs = graphs - self.graphs_seen
+            self.graphs_seen = graphs
+            new_rerecords = rerecords - self.cudagraph_seen
+            self.cudagraph_seen = rerecords
+            if self.steady_since is None:
+                self.warmed_shapes.add(shape)
+                return
+            new_shape = shape not in self.shapes and shape not in self.warmed_shapes
+            self.shapes[shape] = self.shapes.get(shape, 0) + 1
+            if new_shape:
+                self.new_shapes_after_steady += 1
+            if new_graphs > 0:
+                self.recompile_events += 1
+            if new_rerecords > 0:
+                self.cudagraph_events += 1
+        if new_graphs > 0:
+            logging.getLogger(__name__).warning(
+                f"⚠️ [{request_id}] torch.compile compiled {new_graphs} new graph(s) on live traffic, shape={shape}"
+            )
+        if new_rerecords > 0:
+            logging.getLogger(__name__).warning(
+                f"⚠️ [{request_id}] {new_rerecords} CUDA graph re-record(s)/skip(s) on live traffic, shape={shape}"
+            )
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                "compiled_graphs": self.graphs_seen,
+                "compiled_graphs_at_steady_state": self.graphs_at_steady,
+                "recompile_events": self.recompile_events,
+                "cudagraph_rerecord_events": self.cudagraph_events,
+                "new_shapes_after_steady_state": self.new_shapes_after_steady,
+                "shapes": {"x".join(map(str, shape)): count for shape, count in sorted(self.shapes.items())},
+            }
+
+
+def check_compile_steady_state(compile_stats: dict):
+    """Raise if traffic after warmup compiled or re-recorded any graph (takes
+    CompileEventCounter.stats()). Benchmarks call it so a shape that slipped past
+    the buckets fails the run instead of only skewing its timings."""
+    recompiles = compile_stats.get("recompile_events", 0)
+    rerecords = compile_stats.get("cudagraph_rerecord_events", 0)
+    if recompiles or rerecords:
+        raise RuntimeError(
+            f"Graphs changed after warmup: {recompiles} recompile event(s), "
+            f"{rerecords} CUDA graph re-record event(s); shapes seen: {compile_stats.get('shapes')}"
+        )
+
+
 # TTS Service Container
 @app.cls(
     gpu="L4",
     image=tts_image,
+    volumes={"/output": output_vol},
     concurrency_limit=2,
+    allow_concurrent_inputs=8, # Lets concurrent calls meet in the batch scheduler
     keep_warm=0,
     timeout=1800,
     container_idle_timeout=600
@@ -61,22 +1716,177 @@ class StreamingTTSService:
         self.device = None
         self.sampling_rate = None
         self.torch_dtype = None # Added to store dtype for autocast
-        self.token_per_word=100
+        self.token_per_word=100  # Fallback until the token budget is calibrated
+        self.token_budget = TokenBudgetEstimator(self.token_per_word)
+        self.voice_cache = None
+        self.scheduler = None
+        self.audio_cache = None
+        self.compile_counter = CompileEventCounter()
+        # Held around every generate: they share the static KV cache and CUDA graphs
+        self.generate_lock = Lock()
+        # (batch size, description length) -> that bucket's static KV cache (see _generate)
+        self.static_caches = {}
+        self.warmup_timings = None
+        self.warming_up = False
+        self.early_stop_lock = Lock()
+        self.early_stop_stats = {
+            "silence_stops": 0,
+            "runaway_stops": 0,
+            # Estimate against where the generation would likely have ended, and the
+            # upper bound against running on to max_new_tokens
+            "tokens_saved": 0,
+            "gpu_seconds_saved": 0.0,
+            "tokens_saved_upper_bound": 0,
+            "gpu_seconds_saved_upper_bound": 0.0,
+            "trimmed_audio_s": 0.0,
+        }
+        self.cold_start = None
+        self.weights_source = None
+        self.container_id = os.environ.get("MODAL_TASK_ID", f"local-{uuid.uuid4().hex[:8]}")
+        self.last_stats_publish = 0.0
+        # Disk writes and volume commits/reloads happen on _maintain_audio_cache's
+        # thread, never between the chunks of a response
+        self.cache_writes = queue.Queue(maxsize=AUDIO_CACHE_WRITE_QUEUE)
+        self.cache_dirty = False
+        # Identical stream requests in flight on this container share one generation
+        self.inflight = {}
+        self.inflight_lock = Lock()
+        self.streams_started = 0
+        self.streams_coalesced = 0
+        # request_id -> (cancel event, flight) of each live stream, for _watch_cancellations
+        self.watched_streams = {}
+        self.watch_lock = Lock()
         
     
     # Add this function to estimate tokens needed:
-    def estimate_tokens_needed(self, text: str) -> int:
+    def estimate_tokens_needed(self, text: str, voice_key: str = "aryan_default", seed=None) -> int:
         """Estimate tokens based on text length"""
-        words = len(text.split())
-        # Rough estimate: ~50-80 tokens per word for Indic languages
-        estimated_tokens = words * self.token_per_word
-        return max(50, min(estimated_tokens, 2000))  # Clamp between 50-1000
+        # Learned tokens per akshara/word for this voice and script, or
+        # words * token_per_word until enough chunks have been seen. Seeded chunks
+        # always get the latter: max_new_tokens must not move as the estimator learns
+        if seed is None:
+            estimated_tokens, _ = self.token_budget.budget(text, voice_key)
+        else:
+            estimated_tokens = self.token_budget.legacy_budget(text)
+        # Rounded up to a budget bucket so max_new_tokens doesn't force a recompile
+        return bucket_length(estimated_tokens, TOKEN_BUDGET_BUCKETS)
+    
+    def _record_tokens(self, text: str, voice_key: str, budget_tokens: int, audio_samples: int,
+                       censored: bool = False):
+        """Feed one finished chunk's actual length back into the token budget"""
+        if self.warming_up:
+            # Every cold start repeats WARMUP_TEXT - it would calibrate voices on one phrase
+            return
+        frame_rate = self.model.audio_encoder.config.frame_rate
+        generated_tokens = round(audio_samples * frame_rate / self.sampling_rate)
+        # The codebook delay pattern leaves the audio about num_codebooks - 1 frames
+        # short of the decoding steps, so a chunk cut at max_new_tokens shows up here
+        # as budget - num_codebooks tokens, not budget
+        capped = generated_tokens >= budget_tokens - self.model.decoder.config.num_codebooks
+        _, calibrated = self.token_budget.budget(text, voice_key)
+        self.token_budget.record(text, voice_key, budget_tokens, generated_tokens, calibrated, censored or capped)
+    
+    def _early_stopping(self, texts: list, voice_key: str, monitor: SilenceMonitor = None, seed=None):
+        """Stopping criterion for one generate over texts, or None with EARLY_STOPPING
+        off. Seeded generations get none: the runaway threshold is learned, and silence
+        is watched at streaming-only decode points"""
+        if not EARLY_STOPPING or seed is not None:
+            return None
+        expected = [self.token_budget.expected(text, voice_key) for text in texts]
+        # A batch runs until its longest row is done
+        expected_tokens = None if None in expected else max(expected)
+        return EarlyStoppingCriteria(expected_tokens, monitor)
+    
+    def _record_early_stop(self, criterion, budget_tokens: int, elapsed_s: float, request_id: str):
+        """Count a stop and the decoding steps (and GPU time, at this call's per-step rate)
+        it saved. A runaway would have run on to max_new_tokens; a silence stop is
+        credited only up to the expected length, where the model would usually have
+        ended on its own (nothing when uncalibrated). The saving against
+        max_new_tokens is kept as an upper bound."""
+        if criterion is None or criterion.reason is None:
+            return
+        per_step_s = elapsed_s / max(1, criterion.steps)
+        upper_bound = max(0, budget_tokens - criterion.steps)
+        if criterion.reason == "runaway":
+            tokens_saved = upper_bound
+        elif criterion.expected_tokens is not None:
+            tokens_saved = min(upper_bound, max(0, round(criterion.expected_tokens) - criterion.steps))
+        else:
+            tokens_saved = 0
+        gpu_seconds = tokens_saved * per_step_s
+        with self.early_stop_lock:
+            self.early_stop_stats[f"{criterion.reason}_stops"] += 1
+            self.early_stop_stats["tokens_saved"] += tokens_saved
+            self.early_stop_stats["gpu_seconds_saved"] += gpu_seconds
+            self.early_stop_stats["tokens_saved_upper_bound"] += upper_bound
+            self.early_stop_stats["gpu_seconds_saved_upper_bound"] += upper_bound * per_step_s
+        logging.getLogger(__name__).info(
+            f"✂️ [{request_id}] Early stop ({criterion.reason}) at step {criterion.steps}/{budget_tokens}, "
+            f"~{gpu_seconds:.2f}s GPU saved"
+        )
+    
+    def _trim_silence(self, audio, seed=None):
+        # Seeded audio is never trimmed: a stream can only drop whole silent blocks
+        trimmed = trim_trailing_silence(audio, self.sampling_rate) if EARLY_STOPPING and seed is None else audio
+        if len(trimmed) < len(audio):
+            with self.early_stop_lock:
+                self.early_stop_stats["trimmed_audio_s"] += (len(audio) - len(trimmed)) / self.sampling_rate
+        return trimmed
+    
+    def tokenize_prompts(self, texts):
+        """Left-padded prompt tokens, padded up to a PROMPT_LENGTH_BUCKETS length"""
+        tokens = self.tokenizer(texts, padding=True, return_tensors="pt")
+        input_ids, attention_mask = left_pad_tokens(
+            tokens.input_ids, tokens.attention_mask,
+            bucket_length(tokens.input_ids.shape[-1], PROMPT_LENGTH_BUCKETS),
+            self.tokenizer.pad_token_id or 0,
+        )
+        return input_ids.to(self.device), attention_mask.to(self.device)
+    
+    def _generate(self, generation_kwargs: dict, request_id: str):
+        """model.generate, one call at a time: every call shares the compiled forward's
+        CUDA graphs and the model's static KV cache, so concurrent generates (a stream's
+        lookahead, the micro-batch thread, other inputs) would overwrite each other's
+        buffers. Returns the generation and the seconds it took once it held the GPU."""
+        import torch
+        
+        # Batch size and description length: the cross-attention cache is sized by the latter
+        cache_shape = (generation_kwargs["prompt_input_ids"].shape[0], generation_kwargs["input_ids"].shape[-1])
+        with self.generate_lock:
+            # transformers keeps a single static cache on the model and reallocates it
+            # whenever the batch size (or encoder length) changes; one per bucket, kept
+            # at the longest length warmup reached, pins the cache shape to the bucket
+            # instead of whichever call came first
+            if cache_shape in self.static_caches:
+                self.model._cache = self.static_caches[cache_shape]
+            elif hasattr(self.model, "_cache"):
+                del self.model._cache
+            started = time.perf_counter()
+            with torch.autocast(device_type=self.device, dtype=self.torch_dtype):
+                generation = self.model.generate(**generation_kwargs)
+            elapsed_s = time.perf_counter() - started
+            if getattr(self.model, "_cache", None) is not None:
+                self.static_caches[cache_shape] = self.model._cache
+            self._observe_shape(generation_kwargs, request_id)
+        return generation, elapsed_s
+    
+    def _observe_shape(self, generation_kwargs: dict, request_id: str):
+        """Record a generate call's shape; also notices graphs compiled by it"""
+        shape = (
+            generation_kwargs["prompt_input_ids"].shape[0],
+            generation_kwargs["prompt_input_ids"].shape[-1],
+            generation_kwargs["input_ids"].shape[-1],
+            generation_kwargs["max_new_tokens"],
+        )
+        self.compile_counter.observe(shape, request_id)
     
     @modal.enter()
     def load_model(self):
-        import torch
-        from parler_tts import ParlerTTSForConditionalGeneration
-        from transformers import AutoTokenizer
+        profiler = ColdStartProfiler()
+        with profiler.phase("torch_import"):
+            import torch
+            from parler_tts import ParlerTTSForConditionalGeneration
+            from transformers import AutoTokenizer
         
         logging.basicConfig(level=logging.INFO)
         logger = logging.getLogger(__name__)
@@ -90,31 +1900,78 @@ class StreamingTTSService:
         
         # ✅ ADD THIS LINE HERE (after device setup, before model loading):
         if self.device == "cuda":
-            torch.backends.cudnn.benchmark = True
+            if DETERMINISTIC_MODE:
+                # Autotuning may pick different kernels run to run
+                torch.backends.cudnn.deterministic = True
+                torch.backends.cudnn.benchmark = False
+            else:
+                torch.backends.cudnn.benchmark = True
+            # Initialize CUDA up front so device memory is tracked from the first phase
+            torch.cuda.init()
         
         logger.info(f"Using torch_dtype: {self.torch_dtype}")
 
-        self.model = ParlerTTSForConditionalGeneration.from_pretrained(
-            "ai4bharat/indic-parler-tts",
-            torch_dtype=self.torch_dtype # Pass the dtype to from_pretrained
-        ).to(self.device)
+        # The snapshot is already fp16, so it only stands in for the hub checkpoint on GPU
+        manifest = read_snapshot_manifest()
+        snapshot = self.torch_dtype == torch.float16 and snapshot_matches(manifest)
+        if manifest is not None and not snapshot_matches(manifest):
+            # Serving the old model's weights would be worse than a slower cold start
+            logger.warning(f"⚠️ Weight snapshot is for {manifest.get('model_id')}@{manifest.get('revision')}, "
+                           f"not {MODEL_ID}@{MODEL_REVISION}: loading from the hub and rebuilding it")
+            try:
+                create_weight_snapshot.spawn()
+            except Exception as e:
+                logger.warning(f"⚠️ Snapshot rebuild not started: {e}")
+        self.weights_source = WEIGHT_SNAPSHOT_DIR if snapshot else MODEL_ID
+        logger.info(f"📦 Loading weights from {self.weights_source}")
         
-        self.tokenizer = AutoTokenizer.from_pretrained("ai4bharat/indic-parler-tts")
-        self.desc_tokenizer = AutoTokenizer.from_pretrained(self.model.config.text_encoder._name_or_path)
+        with profiler.phase("from_pretrained"):
+            self.model = ParlerTTSForConditionalGeneration.from_pretrained(
+                self.weights_source,
+                torch_dtype=self.torch_dtype, # Pass the dtype to from_pretrained
+                low_cpu_mem_usage=True,       # safetensors are memory-mapped, not copied
+                **({} if snapshot else {"revision": MODEL_REVISION}),
+            )
+        with profiler.phase("device_transfer"):
+            self.model = self.model.to(self.device)
+        
+        with profiler.phase("tokenizers"):
+            if snapshot:
+                self.tokenizer = AutoTokenizer.from_pretrained(os.path.join(WEIGHT_SNAPSHOT_DIR, "tokenizer"))
+                self.desc_tokenizer = AutoTokenizer.from_pretrained(os.path.join(WEIGHT_SNAPSHOT_DIR, "description_tokenizer"))
+            else:
+                self.tokenizer = AutoTokenizer.from_pretrained(MODEL_ID, revision=MODEL_REVISION)
+                self.desc_tokenizer = AutoTokenizer.from_pretrained(self.model.config.text_encoder._name_or_path)
         self.sampling_rate = self.model.config.sampling_rate
         
+        try:
+            self.token_budget.load(tts_token_budget)
+            logger.info(f"✅ Token budget statistics loaded: {self.token_budget.stats()['models']}")
+        except Exception as e:
+            logger.warning(f"⚠️ Token budget load failed: {e}. Starting from token_per_word={self.token_per_word}")
+        
         # --- OPTIMIZATION 2: torch.compile ---
         # This compiles the model for faster execution.
         # It's a powerful optimization for PyTorch 2.0+ models.
-        try:
-            # You can experiment with different modes: "default", "reduce-overhead", "max-autotune"
-            # "max-autotune" can be slower for first run but best for long-running services.
-            # "reduce-overhead" is a good balance.
-            self.model = torch.compile(self.model, mode="reduce-overhead")
-            logger.info("✅ Model compiled with torch.compile!")
-        except Exception as e:
-            logger.warning(f"⚠️ torch.compile failed: {e}. Proceeding without compilation.")
-            # If compilation fails, the original model is used, so it's safe.
+        # Compilation itself is lazy: tracing happens on the first generate, i.e. in warmup
+        with profiler.phase("torch_compile"):
+            try:
+                # You can experiment with different modes: "default", "reduce-overhead", "max-autotune"
+                # "max-autotune" can be slower for first run but best for long-running services.
+                # "reduce-overhead" is a good balance.
+                # Compile forward, not the module: generate() on a compiled module wrapper
+                # runs the original, uncompiled forward. A static KV cache keeps the
+                # decode-step shapes fixed per bucket (the Parler-TTS recommended setup).
+                self.model.generation_config.cache_implementation = "static"
+                torch._dynamo.config.cache_size_limit = DYNAMO_CACHE_SIZE_LIMIT
+                torch._dynamo.config.accumulated_cache_size_limit = max(
+                    torch._dynamo.config.accumulated_cache_size_limit, 4 * DYNAMO_CACHE_SIZE_LIMIT
+                )
+                self.model.forward = torch.compile(self.model.forward, mode="reduce-overhead")
+                logger.info("✅ Model forward compiled with torch.compile (static cache)!")
+            except Exception as e:
+                logger.warning(f"⚠️ torch.compile failed: {e}. Proceeding without compilation.")
+                # If compilation fails, the original model is used, so it's safe.
         
         # ✅ ADD MODEL CACHING OPTIMIZATIONS HERE (after compilation):
         self.model.eval()                           # Set to evaluation mode
@@ -124,61 +1981,315 @@ class StreamingTTSService:
         self.tokenizer.padding_side = "left"        # Optimize padding  
         self.desc_tokenizer.padding_side = "left"   # Optimize padding
         
+        # Voice descriptions are fixed per voice key, so encode them once here
+        # instead of re-running the text encoder on every chunk
+        with profiler.phase("voice_conditioning"):
+            self.voice_cache = VoiceConditioningCache(self._encode_voice_description, max_entries=16)
+            for voice_key, description in VOICE_CONFIGS.items():
+                self.voice_cache.get(voice_key, description)
+        logger.info(f"✅ Voice conditioning cached for {len(VOICE_CONFIGS)} voices")
+        
+        self.scheduler = MicroBatchScheduler(
+            lambda voice_key, chunks: self._generate_batch(chunks, voice_key, "scheduler")
+        )
+        
+        # Inputs aren't accepted until load_model returns, so the container only
+        # reports ready once warmup is done
+        if WARMUP_ON_START:
+            with profiler.phase("warmup"):
+                self.warming_up = True
+                try:
+                    self.warmup_timings = self._run_warmup()
+                except Exception as e:
+                    # A cold first request is better than a container that never starts
+                    logger.warning(f"⚠️ Warmup failed: {e}. Serving without it.")
+                finally:
+                    self.warming_up = False
+        
+        self.audio_cache = AudioCache(disk_dir=AUDIO_CACHE_DIR)
+        Thread(target=self._maintain_audio_cache, daemon=True).start()
+        Thread(target=self._watch_cancellations, daemon=True).start()
+        logger.info(f"✅ Audio cache ready: {AUDIO_CACHE_MEMORY_BYTES // (1024*1024)} MB memory, disk at {AUDIO_CACHE_DIR} "
+                    f"(up to {AUDIO_CACHE_DISK_BYTES // (1024**3)} GB)")
+        
+        # From here on, any new compiled graph is counted as a live recompile
+        self.compile_counter.mark_steady_state()
 
         logger.info(f"✅ TTS model loaded and initialized on {self.device}")
         
-    def chunk_text(self, text: str, max_words: int = 20) -> list:
-        """Adaptive chunking based on word count - Indic Parler TTS recommendation"""
-        import re
+        # One structured record per cold start, also published for the health check
+        self.cold_start = {
+            "container_id": self.container_id,
+            "device": self.device,
+            "weights_source": self.weights_source,
+            **profiler.record(),
+        }
+        logger.info(f"🧊 Cold start: {json.dumps(self.cold_start)}")
+        self._publish_stats(force=True)
+    
+    def _run_warmup(self) -> dict:
+        """Synthesize WARMUP_TEXT per voice on both paths, then touch every shape in
+        warmup_shapes. Returns per-phase wall time in seconds."""
+        import torch
+        from transformers import StoppingCriteriaList
         
-        words = text.split()
-        if len(words) <= max_words:
-            return [text]  # No chunking needed
+        logger = logging.getLogger(__name__)
+        timings = {}
+        started = time.perf_counter()
         
-        # Split by sentences first, using both markers
-        sentences = re.split(r'[।|\.]+', text)
-        chunks = []
-        current_chunk = ""
-        current_word_count = 0
+        # Memory-only cache: warmup must really generate, and its audio shouldn't be kept
+        self.audio_cache = AudioCache(disk_dir=None)
         
-        for sentence in sentences:
-            sentence = sentence.strip()
-            if not sentence:
-                continue
-                
-            sentence_words = len(sentence.split())
-            
-            # If adding this sentence exceeds word limit, save current chunk
-            if current_word_count + sentence_words > max_words and current_chunk:
-                chunks.append(current_chunk.strip())
-                current_chunk = sentence
-                current_word_count = sentence_words
-            else:
-                current_chunk += (" " + sentence if current_chunk else sentence)
-                current_word_count += sentence_words
+        phase_started = time.perf_counter()
+        for voice_key in VOICE_CONFIGS:
+            self._generate_batch([WARMUP_TEXT], voice_key, "warmup")
+        timings["batch_path_s"] = time.perf_counter() - phase_started
         
-        # Add final chunk
-        if current_chunk.strip():
-            chunks.append(current_chunk.strip())
+        phase_started = time.perf_counter()
+        frame_rate = self.model.audio_encoder.config.frame_rate
+        for voice_key in VOICE_CONFIGS:
+            result = {"complete": False}
+            for _ in self._stream_audio_blocks(
+                [WARMUP_TEXT], voice_key, frame_rate, "warmup", 0, Event(), result
+            ):
+                pass
+        timings["stream_path_s"] = time.perf_counter() - phase_started
         
-        return chunks
+        # A few decoding steps per shape, with one voice standing in for every voice
+        # whose description falls in the same length bucket
+        phase_started = time.perf_counter()
+        voice_for_bucket = {}
+        for voice_key in VOICE_CONFIGS:
+            description_length = self.voice_conditioning(voice_key)["input_ids"].shape[-1]
+            voice_for_bucket.setdefault(description_length, voice_key)
+        try:
+            served = {}
+            for _, stats in tts_service_stats.items():
+                for key, count in ((stats.get("compile") or {}).get("shapes") or {}).items():
+                    served[key] = served.get(key, 0) + count
+        except Exception as e:
+            logger.warning(f"⚠️ Served shapes unavailable: {e}. Warming every shape bucket.")
+            served = None
+        shapes = warmup_shapes(sorted(voice_for_bucket), served)
+        filler = self.tokenizer(" ".join([WARMUP_TEXT] * PROMPT_LENGTH_BUCKETS[-1])).input_ids
+        for rows, prompt_length, description_length in shapes:
+            prompt_input_ids = torch.tensor([filler[:prompt_length]] * rows, device=self.device)
+            generation_kwargs = {
+                **self.voice_conditioning(voice_for_bucket[description_length], batch_size=rows),
+                "prompt_input_ids": prompt_input_ids,
+                "prompt_attention_mask": torch.ones_like(prompt_input_ids),
+                **SAMPLING_CONFIG,
+                "min_new_tokens": 1,
+                # The longest budget sizes each static cache for every later call
+                "max_new_tokens": TOKEN_BUDGET_BUCKETS[-1],
+                "stopping_criteria": StoppingCriteriaList([MaxStepsStoppingCriteria(WARMUP_DECODE_STEPS)]),
+            }
+            self._generate(generation_kwargs, "warmup")
+        timings["shape_buckets_s"] = time.perf_counter() - phase_started
+        
+        timings["total_s"] = time.perf_counter() - started
+        logger.info(
+            f"🔥 Warmup done in {timings['total_s']:.1f}s: batch {timings['batch_path_s']:.1f}s, "
+            f"stream {timings['stream_path_s']:.1f}s, "
+            f"{len(shapes)} shapes ({len(voice_for_bucket)} description buckets) {timings['shape_buckets_s']:.1f}s"
+        )
+        return timings
     
-    @modal.method()
-    def batch_synthesis(self, text: str, voice_key: str, request_id: str):
+    def _encode_voice_description(self, description: str) -> dict:
+        """Tokenize and run the text encoder once for a voice description"""
         import torch
-        import numpy as np
-        import soundfile as sf
-        import io
-        import time
-
+        
+        # The text encoder isn't compiled (only the model's forward is) - it runs once per voice
+        model = self.model
+        desc_tokens = self.desc_tokenizer(description, return_tensors="pt")
+        # Every voice gets a bucketed description length, so switching voices keeps the cross-attention shape
+        input_ids, attention_mask = left_pad_tokens(
+            desc_tokens.input_ids, desc_tokens.attention_mask,
+            bucket_length(desc_tokens.input_ids.shape[-1], DESCRIPTION_LENGTH_BUCKETS),
+            self.desc_tokenizer.pad_token_id or 0,
+        )
+        input_ids, attention_mask = input_ids.to(self.device), attention_mask.to(self.device)
+        
+        with torch.autocast(device_type=self.device, dtype=self.torch_dtype):
+            hidden_states = model.get_text_encoder()(
+                input_ids=input_ids,
+                attention_mask=attention_mask,
+            ).last_hidden_state
+            # Same projection + masking generate() applies when it encodes itself
+            if (
+                model.text_encoder.config.hidden_size != model.decoder.config.hidden_size
+                and model.decoder.config.cross_attention_hidden_size is None
+            ):
+                hidden_states = model.enc_to_dec_proj(hidden_states)
+            hidden_states = hidden_states * attention_mask[..., None]
+        
+        return {
+            "input_ids": input_ids,
+            "attention_mask": attention_mask,
+            "encoder_hidden_states": hidden_states,
+        }
+    
+    def voice_conditioning(self, voice_key: str, batch_size: int = 1) -> dict:
+        """Generation kwargs for the cached voice description of voice_key"""
+        from transformers.modeling_outputs import BaseModelOutput
+        
+        voice_key = resolve_voice_key(voice_key)
+        entry = self.voice_cache.get(voice_key, VOICE_CONFIGS[voice_key])
+        
+        input_ids = entry["input_ids"]
+        attention_mask = entry["attention_mask"]
+        hidden_states = entry["encoder_hidden_states"]
+        if batch_size > 1:
+            input_ids = input_ids.expand(batch_size, -1)
+            attention_mask = attention_mask.expand(batch_size, -1)
+            hidden_states = hidden_states.expand(batch_size, -1, -1)
+        
+        return {
+            "input_ids": input_ids,
+            "attention_mask": attention_mask,
+            "encoder_outputs": BaseModelOutput(last_hidden_state=hidden_states),
+        }
+    
+    def _collect_stats(self) -> dict:
+        return {
+            "container_id": self.container_id,
+            "updated_at": time.time(),
+            "voice_cache": self.voice_cache.stats() if self.voice_cache else None,
+            "scheduler": self.scheduler.stats() if self.scheduler else None,
+            "audio_cache": self.audio_cache.stats() if self.audio_cache else None,
+            "compile": self.compile_counter.stats(),
+            "token_budget": self.token_budget.stats(),
+            "early_stopping": dict(self.early_stop_stats),
+            "warmup": self.warmup_timings,
+            "cold_start": self.cold_start,
+            "coalescing": {
+                "inflight": len(self.inflight),
+                "streams_started": self.streams_started,
+                "streams_coalesced": self.streams_coalesced,
+            },
+        }
+    
+    @modal.method()
+    def service_stats(self) -> dict:
+        """Counters for the health check"""
+        return self._collect_stats()
+    
+    def _publish_stats(self, force: bool = False):
+        """Push counters to tts_service_stats, at most every STATS_PUBLISH_INTERVAL_S"""
+        now = time.time()
+        if not force and now - self.last_stats_publish < STATS_PUBLISH_INTERVAL_S:
+            return
+        self.last_stats_publish = now
+        try:
+            tts_service_stats.put(self.container_id, self._collect_stats())
+        except Exception as e:
+            logging.getLogger(__name__).warning(f"⚠️ Stats publish failed: {e}")
+        try:
+            self.token_budget.publish(tts_token_budget)
+        except Exception as e:
+            logging.getLogger(__name__).warning(f"⚠️ Token budget publish failed: {e}")
+    
+    def _cache_audio(self, cache_key: str, audio):
+        """Store finished audio: in memory now, on disk from the cache thread"""
+        self.audio_cache.put(cache_key, audio, write_disk=False)
+        if not self.audio_cache.disk_dir:
+            return
+        try:
+            self.cache_writes.put_nowait((cache_key, audio))
+        except queue.Full:
+            logging.getLogger(__name__).warning("⚠️ Audio cache write queue full, entry kept in memory only")
+    
+    def _write_cached_audio(self, cache_key: str, audio):
+        try:
+            if self.audio_cache.write_disk(cache_key, audio):
+                self.cache_dirty = True
+        except Exception as e:
+            logging.getLogger(__name__).warning(f"⚠️ Audio cache disk write failed: {e}")
+    
+    def _maintain_audio_cache(self):
+        """Background thread owning the disk tier: writes queued entries, and every
+        AUDIO_CACHE_COMMIT_INTERVAL_S commits them and reloads the volume so entries
+        from other containers become visible; prunes now and then"""
         logger = logging.getLogger(__name__)
-        logger.info(f"🎵 [{request_id}] BATCH synthesis: '{text[:50]}...'")
+        next_sync = time.time() + AUDIO_CACHE_COMMIT_INTERVAL_S
+        last_prune = 0.0
+        while True:
+            timeout = next_sync - time.time()
+            if timeout > 0:
+                try:
+                    cache_key, audio = self.cache_writes.get(timeout=timeout)
+                except queue.Empty:
+                    continue
+                self._write_cached_audio(cache_key, audio)
+                continue
+            
+            next_sync = time.time() + AUDIO_CACHE_COMMIT_INTERVAL_S
+            try:
+                if self.cache_dirty:
+                    output_vol.commit()
+                    self.cache_dirty = False
+                output_vol.reload()
+            except Exception as e:
+                logger.warning(f"⚠️ Audio cache volume sync failed: {e}")
+                continue
+            
+            if time.time() - last_prune >= AUDIO_CACHE_PRUNE_INTERVAL_S:
+                last_prune = time.time()
+                try:
+                    removed = self.audio_cache.prune_disk()
+                    if removed:
+                        self.cache_dirty = True
+                        logger.info(f"🧹 Audio cache pruned {removed} disk entries, "
+                                    f"{self.audio_cache.disk_bytes / (1024**3):.2f} GB left")
+                except Exception as e:
+                    logger.warning(f"⚠️ Audio cache prune failed: {e}")
+    
+    @modal.exit()
+    def on_exit(self):
+        self._publish_stats(force=True)
+        # Entries still queued for disk go out with the final commit
+        while True:
+            try:
+                cache_key, audio = self.cache_writes.get_nowait()
+            except queue.Empty:
+                break
+            self._write_cached_audio(cache_key, audio)
+        try:
+            output_vol.commit()
+        except Exception:
+            pass
         
-        # Chunk the text
-        text_chunks = self.chunk_text(text, max_words=20)  # ✅ Explicit parameter
-        logger.info(f"📝 [{request_id}] Split into {len(text_chunks)} chunks")
+    def chunk_text(self, text: str, max_words: int = CHUNK_MAX_WORDS) -> list:
+        """Adaptive chunking based on word count - Indic Parler TTS recommendation"""
+        return chunk_sanskrit_text(text, max_words)
+    
+    def _resolve_seed(self, seed):
+        if seed is None and DETERMINISTIC_MODE:
+            return DETERMINISTIC_DEFAULT_SEED
+        return seed
+    
+    def _sampling_kwargs(self, chunk: str, seed) -> dict:
+        """Generation kwargs for sampling: the global RNG, or a dedicated generator seeded for this chunk"""
+        if seed is None:
+            return dict(SAMPLING_CONFIG)
+        from transformers import LogitsProcessorList
+        
+        # Seeded: sampling happens in the processor, so generate itself runs greedy.
+        # do_sample=True would also apply the generation config's top_k/top_p - so does the processor
+        generation_config = self.model.generation_config
+        processor = SeededSamplingLogitsProcessor(
+            derive_chunk_seed(seed, chunk), SAMPLING_CONFIG["temperature"], self.device,
+            top_k=SAMPLING_CONFIG.get("top_k", generation_config.top_k),
+            top_p=SAMPLING_CONFIG.get("top_p", generation_config.top_p),
+        )
+        return {"do_sample": False, "logits_processor": LogitsProcessorList([processor])}
+    
+    def _generate_chunks_sequential(self, text_chunks: list, voice_key: str, request_id: str, seed=None) -> list:
+        """One generate call per chunk - the original batch_synthesis loop. Failed chunks come back as None."""
+        import torch
+        from transformers import StoppingCriteriaList
         
-        voice_description = VOICE_CONFIGS.get(voice_key, VOICE_CONFIGS["aryan_default"])
+        logger = logging.getLogger(__name__)
         all_audio_chunks = []
         
         # Process each chunk
@@ -186,189 +2297,726 @@ class StreamingTTSService:
             logger.info(f"🔄 [{request_id}] Processing chunk {i+1}/{len(text_chunks)}: '{chunk[:30]}...'")
             
             # Tokenization for this chunk
-            text_tokens = self.tokenizer(chunk, return_tensors="pt").to(self.device)
-            desc_tokens = self.desc_tokenizer(voice_description, return_tensors="pt").to(self.device)
+            prompt_input_ids, prompt_attention_mask = self.tokenize_prompts(chunk)
             
-            estimated_tokens = self.estimate_tokens_needed(chunk)
+            estimated_tokens = self.estimate_tokens_needed(chunk, voice_key, seed)
             logger.info(f"🔍 [{request_id}] Batch chunk {i+1}: '{chunk}' ({len(chunk.split())} words)")
             logger.info(f"🔍 [{request_id}] Batch estimated tokens: {estimated_tokens}")
             
             # HF-style generation parameters
+            early_stop = self._early_stopping([chunk], voice_key, seed=seed)
             generation_kwargs = {
-                "input_ids": desc_tokens.input_ids,
-                "attention_mask": desc_tokens.attention_mask,
-                "prompt_input_ids": text_tokens.input_ids,
-                "prompt_attention_mask": text_tokens.attention_mask,
-                "do_sample": True,
-                "temperature": 1.0,                   # ✅ HF uses temperature
+                **self.voice_conditioning(voice_key),
+                "prompt_input_ids": prompt_input_ids,
+                "prompt_attention_mask": prompt_attention_mask,
+                **self._sampling_kwargs(chunk, seed),
                 "return_dict_in_generate": True,
                 "min_new_tokens": 5, 
-                "max_new_tokens": self.estimate_tokens_needed(chunk)  # ✅ ADD THIS LINE
+                "max_new_tokens": estimated_tokens,  # ✅ ADD THIS LINE
+                "stopping_criteria": StoppingCriteriaList([early_stop] if early_stop else []),
             }
             
             logger.info(f"🔍 [{request_id}] Batch generation config: min=5, max={estimated_tokens}")
 
             
-            with torch.autocast(device_type=self.device, dtype=self.torch_dtype):
-                generation = self.model.generate(**generation_kwargs)
+            generation, elapsed_s = self._generate(generation_kwargs, request_id)
+            self._record_early_stop(early_stop, estimated_tokens, elapsed_s, request_id)
             
             # Extract audio using HF method
             if hasattr(generation, 'sequences') and hasattr(generation, 'audios_length'):
                 audio = generation.sequences[0, :generation.audios_length[0]]
                 audio_numpy = audio.to(torch.float32).cpu().numpy().squeeze()
             else:
-                logger.error(f"❌ [{request_id}] Generation missing sequences for chunk {i+1}")
-                continue
-                
-            
+                logger.error(f"❌ [{request_id}] Generation missing sequences for chunk {i+1}")
+                all_audio_chunks.append(None)
+                continue
+
+            self._record_tokens(chunk, voice_key, estimated_tokens, len(audio_numpy),
+                                censored=bool(early_stop and early_stop.reason == "runaway"))
+            audio_numpy = self._trim_silence(audio_numpy, seed)
+            all_audio_chunks.append(audio_numpy)
+            logger.info(f"🔍 [{request_id}] Batch chunk {i+1} generated audio: {len(audio_numpy)} samples")
+            logger.info(f"✅ [{request_id}] Chunk {i+1} audio: {audio_numpy.shape}, Duration: {len(audio_numpy)/self.sampling_rate:.3f}s")
+        
+        return all_audio_chunks
+    
+    def _generate_batch(self, batch: list, voice_key: str, request_id: str) -> list:
+        """One left-padded generate over batch, trimmed per row by audios_length"""
+        import torch
+        from transformers import StoppingCriteriaList
+        
+        logger = logging.getLogger(__name__)
+        
+        # Repeat rows fill the batch up to its bucket, so the batch size is a precompiled
+        # shape too; they cost a little compute and are dropped below
+        rows = bucket_length(len(batch), BATCH_SIZE_BUCKETS)
+        padded_batch = batch + [batch[-1]] * (rows - len(batch))
+        
+        # Both tokenizers are left-padded (see load_model)
+        prompt_input_ids, prompt_attention_mask = self.tokenize_prompts(padded_batch)
+        
+        # The batch runs until its longest row is done
+        estimated_tokens = max(self.estimate_tokens_needed(chunk, voice_key) for chunk in batch)
+        logger.info(f"🔄 [{request_id}] Batched generate: {len(batch)} chunks (padded to {rows}), "
+                    f"voice={voice_key}, max={estimated_tokens}")
+        
+        # No decoded audio during a batched generate, so only the token-rate guard applies
+        early_stop = self._early_stopping(batch, voice_key)
+        generation_kwargs = {
+            **self.voice_conditioning(voice_key, batch_size=rows),
+            "prompt_input_ids": prompt_input_ids,
+            "prompt_attention_mask": prompt_attention_mask,
+            **SAMPLING_CONFIG,
+            "return_dict_in_generate": True,
+            "min_new_tokens": 5,
+            "max_new_tokens": estimated_tokens,
+            "stopping_criteria": StoppingCriteriaList([early_stop] if early_stop else []),
+        }
+        
+        generation, elapsed_s = self._generate(generation_kwargs, request_id)
+        self._record_early_stop(early_stop, estimated_tokens, elapsed_s, request_id)
+        
+        if not (hasattr(generation, 'sequences') and hasattr(generation, 'audios_length')):
+            raise RuntimeError(f"Batched generation missing sequences for {len(batch)} chunks")
+        
+        sequences = generation.sequences.to(torch.float32).cpu()
+        runaway = bool(early_stop and early_stop.reason == "runaway")
+        for chunk, length in zip(batch, generation.audios_length):
+            self._record_tokens(chunk, voice_key, estimated_tokens, int(length), censored=runaway)
+        return [
+            self._trim_silence(sequences[row, :int(generation.audios_length[row])].numpy().squeeze())
+            for row in range(len(batch))
+        ]
+    
+    def _generate_chunks_batched(self, text_chunks: list, voice_key: str, request_id: str) -> list:
+        """Batched generation for one request's chunks, shared with concurrent requests via the scheduler"""
+        logger = logging.getLogger(__name__)
+        
+        if self.scheduler is not None:
+            futures = self.scheduler.submit(voice_key, text_chunks)
+            all_audio_chunks = [future.result() for future in futures]
+        else:
+            all_audio_chunks = []
+            for start in range(0, len(text_chunks), MAX_BATCH_CHUNKS):
+                all_audio_chunks.extend(
+                    self._generate_batch(text_chunks[start:start + MAX_BATCH_CHUNKS], voice_key, request_id)
+                )
+        
+        for i, audio_numpy in enumerate(all_audio_chunks):
+            logger.info(f"✅ [{request_id}] Chunk {i+1} audio: {audio_numpy.shape}, Duration: {len(audio_numpy)/self.sampling_rate:.3f}s")
+        return all_audio_chunks
+    
+    @modal.method()
+    def batch_synthesis(self, text: str, voice_key: str, request_id: str, batched: bool = True,
+                        sample_format: str = None, sample_rate: int = None, seed: int = None,
+                        use_cache: bool = True, return_stats: bool = False):
+        """WAV bytes of the whole text (None if no chunk could be generated). With
+        return_stats, {"audio": <WAV bytes>, "stats": {...}} instead: the per-request
+        counters stream_synthesis ends with, plus generate and total wall time."""
+        import numpy as np
+        import soundfile as sf
+        import io
+
+        logger = logging.getLogger(__name__)
+        started = time.perf_counter()
+        stats = {"response_cache_hit": False, "text_chunks": 0, "cached_chunks": 0, "generated_chunks": 0,
+                 "failed_chunks": 0, "generate_s": 0.0}
+        logger.info(f"🎵 [{request_id}] BATCH synthesis: '{text[:50]}...'")
+        
+        error = validate_output_format(sample_format, sample_rate)
+        if error:
+            raise ValueError(error)
+        
+        seed = self._resolve_seed(seed)
+        if seed is not None and batched:
+            # Padding changes the numerics, so seeded chunks always run at batch size 1
+            logger.info(f"🎲 [{request_id}] Seed {seed}: generating chunks one at a time for reproducible audio")
+            batched = False
+        
+        cache_key = AudioCache.make_key(text, resolve_voice_key(voice_key), SAMPLING_CONFIG, seed=seed)
+        # use_cache=False (benchmarks) always generates, and leaves the cache untouched
+        final_audio = self.audio_cache.get(cache_key) if use_cache else None
+        
+        if final_audio is not None:
+            logger.info(f"💾 [{request_id}] Audio cache hit: {len(final_audio)/self.sampling_rate:.3f}s, no generation")
+            stats["response_cache_hit"] = True
+        else:
+            # Chunk the text
+            text_chunks = self.chunk_text(text, max_words=20)  # ✅ Explicit parameter
+            logger.info(f"📝 [{request_id}] Split into {len(text_chunks)} chunks (batched={batched})")
+            
+            # Sentences repeat far more often than whole replies: serve cached
+            # chunks and only generate the rest
+            chunk_keys = [
+                AudioCache.make_key(chunk, resolve_voice_key(voice_key), SAMPLING_CONFIG, seed=seed, scope="chunk")
+                for chunk in text_chunks
+            ]
+            chunk_audio = [self.audio_cache.get(key) if use_cache else None for key in chunk_keys]
+            missing = [i for i, audio in enumerate(chunk_audio) if audio is None]
+            logger.info(f"💾 [{request_id}] Chunks: {len(text_chunks) - len(missing)} cached, {len(missing)} to generate")
+            stats.update(text_chunks=len(text_chunks), cached_chunks=len(text_chunks) - len(missing),
+                         generated_chunks=len(missing))
+            
+            if missing:
+                missing_chunks = [text_chunks[i] for i in missing]
+                generate_started = time.perf_counter()
+                if batched:
+                    generated = self._generate_chunks_batched(missing_chunks, voice_key, request_id)
+                else:
+                    generated = self._generate_chunks_sequential(missing_chunks, voice_key, request_id, seed)
+                stats["generate_s"] = time.perf_counter() - generate_started
+                for i, audio in zip(missing, generated):
+                    chunk_audio[i] = audio
+                    if audio is not None and use_cache:
+                        self._cache_audio(chunk_keys[i], audio)
+            
+            all_audio_chunks = [audio for audio in chunk_audio if audio is not None]
+            stats["failed_chunks"] = len(text_chunks) - len(all_audio_chunks)
+            
+            # Concatenate all chunks with silence padding
+            if not all_audio_chunks:
+                logger.error(f"❌ [{request_id}] No audio chunks generated")
+                return {"audio": None, "stats": stats} if return_stats else None
+            
+            # Add silence between chunks (0.1 second)
+            silence_samples = int(0.1 * self.sampling_rate)
+            silence = np.zeros(silence_samples, dtype=np.float32)
+            
+            final_audio = all_audio_chunks[0]
+            for chunk in all_audio_chunks[1:]:
+                final_audio = np.concatenate([final_audio, silence, chunk])
+            
+            logger.info(f"🔗 [{request_id}] Final concatenated audio: {final_audio.shape}, Duration: {len(final_audio)/self.sampling_rate:.3f}s")
+            
+            # Only cache complete responses - a dropped chunk would be replayed forever
+            if use_cache and len(all_audio_chunks) == len(text_chunks):
+                self._cache_audio(cache_key, final_audio)
+        
+        self._publish_stats()
+        
+        # Convert to WAV - 16-bit at the model rate unless the caller asked otherwise
+        output_rate = sample_rate or self.sampling_rate
+        final_audio = resample_audio(final_audio.astype(np.float32), self.sampling_rate, output_rate)
+        sample_format = sample_format or "s16"
+        subtype = "PCM_16" if sample_format == "s16" else "FLOAT"
+        
+        buffer = io.BytesIO()
+        sf.write(buffer, quantize_audio(final_audio, sample_format), output_rate, format='WAV', subtype=subtype)
+        buffer.seek(0)
+        wav_bytes = buffer.read()
+        if not return_stats:
+            return wav_bytes
+        stats.update(batched=batched, audio_s=len(final_audio) / output_rate, total_s=time.perf_counter() - started)
+        return {"audio": wav_bytes, "stats": stats}
+
+    
+    
+    
+    
+    def _cancel_requested(self, request_id: str) -> bool:
+        """Whether request_id was cancelled within the last CANCELLATION_TTL_S"""
+        try:
+            cancelled_at = tts_cancellations.get(request_id)
+        except Exception as e:
+            logging.getLogger(__name__).warning(f"⚠️ [{request_id}] Cancel lookup failed: {e}")
+            return False
+        return cancelled_at is not None and time.time() - cancelled_at < CANCELLATION_TTL_S
+    
+    def _watch_cancellations(self):
+        """Background thread: every CANCEL_POLL_INTERVAL_S, sets the cancel event of
+        each live stream whose request was cancelled and wakes its reader, which then
+        detaches - the last subscriber out stops the generate on its next decoding
+        step, not at the end of the 0.2-2 s block it is producing. Deletes expired
+        cancellations now and then."""
+        logger = logging.getLogger(__name__)
+        last_prune = 0.0
+        while True:
+            time.sleep(CANCEL_POLL_INTERVAL_S)
+            with self.watch_lock:
+                watched = list(self.watched_streams.items())
+            for request_id, (cancel_event, flight) in watched:
+                if not cancel_event.is_set() and self._cancel_requested(request_id):
+                    cancel_event.set()
+                    flight.wake()
+            
+            if time.time() - last_prune >= CANCELLATION_PRUNE_INTERVAL_S:
+                last_prune = time.time()
+                try:
+                    expired = [request_id for request_id, cancelled_at in tts_cancellations.items()
+                               if time.time() - cancelled_at >= CANCELLATION_TTL_S]
+                    for request_id in expired:
+                        tts_cancellations.pop(request_id)
+                except Exception as e:
+                    logger.warning(f"⚠️ Cancellation prune failed: {e}")
+    
+    def _start_stream_generation(self, chunk: str, voice_key: str, play_steps: int, request_id: str,
+                                 cancel_event: Event, seed=None, step_policy: AdaptivePlaySteps = None) -> dict:
+        """Kick off generate for one text chunk on a background thread.
+
+        Returns the generation handle: streamer, thread, estimated_tokens, and
+        failed (set if generate raised)."""
+        import numpy as np
+        from parler_tts import ParlerTTSStreamer
+        from transformers import StoppingCriteriaList
+        
+        logger = logging.getLogger(__name__)
+        
+        # Tokenization for this chunk
+        prompt_input_ids, prompt_attention_mask = self.tokenize_prompts(chunk)
+        
+        estimated_tokens = self.estimate_tokens_needed(chunk, voice_key, seed)
+        logger.info(f"🔍 [{request_id}] Text: '{chunk}' ({len(chunk.split())} words)")
+        logger.info(f"🔍 [{request_id}] Estimated tokens needed: {estimated_tokens}")
+        
+        if step_policy is not None:
+            play_steps = step_policy.next_step_tokens()
+        streamer = ParlerTTSStreamer(self.model, device=self.device, play_steps=play_steps)
+        steps = []
+        
+        if step_policy is not None:
+            finalize_step = streamer.on_finalized_audio
+            last_emission = {"tokens": 0, "at": time.perf_counter()}
+            
+            def on_step_emitted(audio, stream_end=False):
+                # The streamer decodes whenever its token count is a multiple of
+                # play_steps, so setting play_steps to the absolute count of the
+                # next emission makes that the very next decode
+                if not stream_end:
+                    tokens = streamer.token_cache.shape[-1]
+                    now = time.perf_counter()
+                    step_policy.on_emission(tokens - last_emission["tokens"], now - last_emission["at"])
+                    steps.append(round((tokens - last_emission["tokens"]) / step_policy.frame_rate, 3))
+                    last_emission.update(tokens=tokens, at=now)
+                    streamer.play_steps = tokens + step_policy.next_step_tokens()
+                finalize_step(audio, stream_end=stream_end)
+            
+            streamer.on_finalized_audio = on_step_emitted
+        
+        early_stop = self._early_stopping([chunk], voice_key, SilenceMonitor(self.sampling_rate), seed)
+        if early_stop is not None:
+            finalize = streamer.on_finalized_audio
+            
+            def on_finalized_audio(audio, stream_end=False):
+                # Watch the audio as it is decoded on the generate thread, not when
+                # the consumer gets to it (lookahead chunks run ahead of the consumer)
+                if len(audio):
+                    early_stop.monitor.observe(np.asarray(audio, dtype=np.float32))
+                finalize(audio, stream_end=stream_end)
+            
+            streamer.on_finalized_audio = on_finalized_audio
+        
+        generation_kwargs = {
+            **self.voice_conditioning(voice_key),
+            "prompt_input_ids": prompt_input_ids,
+            "prompt_attention_mask": prompt_attention_mask,
+            "streamer": streamer,
+            **self._sampling_kwargs(chunk, seed),  # ✅ Same sampling as batch
+            "min_new_tokens": 5,       
+            "max_new_tokens": estimated_tokens,    
+            "stopping_criteria": StoppingCriteriaList(
+                [CancelStoppingCriteria(cancel_event)] + ([early_stop] if early_stop else [])
+            ),
+        }
+        logger.info(f"🔍 [{request_id}] Generation config: min={generation_kwargs['min_new_tokens']}, max={generation_kwargs['max_new_tokens']}")
+        
+        generation = {
+            "streamer": streamer, "estimated_tokens": estimated_tokens, "failed": False,
+            "chunk": chunk, "voice_key": voice_key, "early_stop": early_stop, "steps": steps,
+            "seeded": seed is not None,
+        }
+        
+        def run_generate():
+            # autocast is thread-local, so _generate enters it on this thread
+            try:
+                _, elapsed_s = self._generate(generation_kwargs, request_id)
+                self._record_early_stop(early_stop, estimated_tokens, elapsed_s, request_id)
+            except Exception as e:
+                logger.error(f"❌ [{request_id}] Generation failed for '{chunk[:30]}...': {e}")
+                generation["failed"] = True
+                # Unblock the consumer instead of leaving it waiting on the streamer
+                streamer.on_finalized_audio(np.zeros(0, dtype=np.float32), stream_end=True)
+        
+        generation["thread"] = Thread(target=run_generate, daemon=True)
+        generation["thread"].start()
+        return generation
+    
+    def _stream_audio_blocks(self, text_chunks: list, voice_key: str, play_steps: int, request_id: str,
+                             lookahead: int, cancel_event: Event, result: dict, seed=None,
+                             step_policy: AdaptivePlaySteps = None, use_cache: bool = True):
+        """Raw float32 blocks for text_chunks in order: streamer chunks plus the
+        0.1 s silence between text chunks. Chunks found in the audio cache are
+        replayed instead of generated, and newly generated chunks are cached
+        (neither with use_cache=False).
+        Fills result with per-request chunk counts and sets result["complete"]
+        only if every chunk was produced without error or cancellation."""
+        import numpy as np
+        
+        logger = logging.getLogger(__name__)
+        
+        # Generations already started (or cache hits), in text order. Chunk N+1..N+lookahead
+        # generate while chunk N streams; audio is still drained strictly in order.
+        pending = deque()
+        next_to_start = 0
+        failed_chunks = 0
+        result["cached_chunks"] = 0
+        result["generated_chunks"] = 0
+        block_samples = max(1, play_steps * self.sampling_rate // self.model.audio_encoder.config.frame_rate)
+        
+        def start_next():
+            nonlocal next_to_start
+            chunk = text_chunks[next_to_start]
+            cache_key = (AudioCache.make_key(chunk, resolve_voice_key(voice_key), SAMPLING_CONFIG, seed=seed, scope="chunk")
+                         if use_cache else None)
+            cached_audio = self.audio_cache.get(cache_key) if use_cache else None
+            if cached_audio is not None:
+                logger.info(f"💾 [{request_id}] Chunk {next_to_start+1}/{len(text_chunks)} cached: '{chunk[:30]}...'")
+                pending.append({"cached": cached_audio, "cache_key": cache_key})
+            else:
+                logger.info(f"🔄 [{request_id}] Starting generation {next_to_start+1}/{len(text_chunks)}: '{chunk[:30]}...'")
+                generation = self._start_stream_generation(
+                    chunk, voice_key, play_steps, request_id, cancel_event, seed, step_policy
+                )
+                generation["cache_key"] = cache_key
+                pending.append(generation)
+            next_to_start += 1
+        
+        def live_generations() -> int:
+            return sum(1 for generation in pending if "thread" in generation)
+        
+        try:
+            start_next()
             
-
-            all_audio_chunks.append(audio_numpy)
-            logger.info(f"🔍 [{request_id}] Batch chunk {i+1} generated audio: {len(audio_numpy)} samples")
-            logger.info(f"✅ [{request_id}] Chunk {i+1} audio: {audio_numpy.shape}, Duration: {len(audio_numpy)/self.sampling_rate:.3f}s")
+            for chunk_idx in range(len(text_chunks)):
+                if cancel_event.is_set():
+                    break
+                generation = pending.popleft()
+                
+                # Fill the lookahead window while this chunk streams; cache hits don't use a slot
+                while next_to_start < len(text_chunks) and live_generations() < lookahead:
+                    start_next()
+                
+                if "cached" in generation:
+                    result["cached_chunks"] += 1
+                    cached_audio = generation["cached"]
+                    for start in range(0, len(cached_audio), block_samples):
+                        yield cached_audio[start:start + block_samples]
+                else:
+                    result["generated_chunks"] += 1
+                    yield from self._drain_generation(generation, chunk_idx, play_steps, request_id, cancel_event)
+                    failed_chunks += generation["failed"]
+                    if step_policy is not None:
+                        step_policy.schedule.append(generation["steps"])
+                
+                if cancel_event.is_set():
+                    break
+                
+                # lookahead=0 is the old strictly sequential behaviour
+                if lookahead == 0 and next_to_start < len(text_chunks):
+                    start_next()
+                
+                # ✅ ADD BRIEF SILENCE BETWEEN TEXT CHUNKS
+                if chunk_idx < len(text_chunks) - 1:  # Not the last chunk
+                    silence_duration = 0.1  # 100ms silence
+                    silence_samples = int(silence_duration * self.sampling_rate)
+                    yield np.zeros(silence_samples, dtype=np.float32)
             
+            result["complete"] = not cancel_event.is_set() and failed_chunks == 0
         
-        # Concatenate all chunks with silence padding
-        if not all_audio_chunks:
-            logger.error(f"❌ [{request_id}] No audio chunks generated")
-            return None
-        
-        # Add silence between chunks (0.1 second)
-        silence_samples = int(0.1 * self.sampling_rate)
-        silence = np.zeros(silence_samples, dtype=np.float32)
+        finally:
+            if live_generations():
+                cancel_event.set()
+                for lookahead_generation in pending:
+                    if "thread" in lookahead_generation:
+                        lookahead_generation["thread"].join()
+            if cancel_event.is_set():
+                logger.info(f"🛑 [{request_id}] Stream cancelled, dropped {len(text_chunks) - next_to_start + len(pending)} queued text chunks")
+    
+    def _drain_generation(self, generation: dict, chunk_idx: int, play_steps: int, request_id: str,
+                          cancel_event: Event):
+        """Yield one generation's streamer output, cancelling it if the consumer stops early.
+        Blocks of silence after speech are held back until speech resumes, so trailing
+        silence is never sent (seeded chunks send everything, as batch_synthesis keeps
+        it). Caches the chunk's audio if it finished cleanly."""
+        import numpy as np
         
-        final_audio = all_audio_chunks[0]
-        for chunk in all_audio_chunks[1:]:
-            final_audio = np.concatenate([final_audio, silence, chunk])
+        logger = logging.getLogger(__name__)
+        chunk_count = 0
+        total_samples = 0 
+        drained = False
+        recorded = []
+        held = []
+        silence = SilenceMonitor(self.sampling_rate)
         
-        logger.info(f"🔗 [{request_id}] Final concatenated audio: {final_audio.shape}, Duration: {len(final_audio)/self.sampling_rate:.3f}s")
+        try:
+            for audio_chunk in generation["streamer"]:
+                if audio_chunk.shape[0] == 0:
+                    logger.info(f"🔍 [{request_id}] Streamer stopped yielding - chunk {chunk_count}")
+                    break
+                    
+                chunk_count += 1  # ✅ Increment counter
+                total_samples += audio_chunk.shape[0]  # ✅ Add this line
+                    
+                logger.info(f"🔍 [{request_id}] Chunk {chunk_count}: {audio_chunk.shape[0]} samples")  # ✅ Add this
+                
+                block = audio_chunk.astype(np.float32, copy=False)
+                if EARLY_STOPPING and not generation["seeded"] and silence.observe(block):
+                    held.append(block)
+                else:
+                    for held_block in held:
+                        recorded.append(held_block)
+                        yield held_block
+                    held.clear()
+                    recorded.append(block)
+                    yield block
+                
+                if cancel_event.is_set():
+                    break
+            drained = not cancel_event.is_set()
+            if held:
+                with self.early_stop_lock:
+                    self.early_stop_stats["trimmed_audio_s"] += sum(len(b) for b in held) / self.sampling_rate
+                
+        finally:
+            # Consumer went away mid-chunk: stop the GPU rather than finish unheard audio
+            if not drained:
+                cancel_event.set()
+            generation["thread"].join()
+            
+            logger.info(f"🔍 [{request_id}] Text chunk {chunk_idx+1} complete: {chunk_count} audio chunks generated")
+            if generation["steps"]:
+                logger.info(f"🔍 [{request_id}] Adaptive steps (s): {generation['steps']}")
+            else:
+                logger.info(f"🔍 [{request_id}] Total tokens likely generated: ~{chunk_count * play_steps}")
+            logger.info(f"🔍 [{request_id}] Expected tokens: {generation['estimated_tokens']}")
+            logger.info(f"🔍 [{request_id}] Streaming total: {total_samples} samples across {chunk_count} chunks")  # ✅ Add this
         
-        # Convert to WAV
-        buffer = io.BytesIO()
-        sf.write(buffer, final_audio.astype(np.float32), self.sampling_rate, format='WAV')
-        buffer.seek(0)
-        return buffer.read()
-
-    
-    
-    
+        if drained and not generation["failed"] and recorded:
+            early_stop = generation["early_stop"]
+            self._record_tokens(generation["chunk"], generation["voice_key"], generation["estimated_tokens"], total_samples,
+                                censored=bool(early_stop and early_stop.reason == "runaway"))
+            if generation["cache_key"] is not None:
+                self._cache_audio(generation["cache_key"], np.concatenate(recorded))
     
     @modal.method()
-    def stream_synthesis(self, text: str, voice_key: str, play_steps_in_s: float, request_id: str):
-        import torch
+    def stream_synthesis(self, text: str, voice_key: str, play_steps_in_s: float, request_id: str,
+                         lookahead: int = STREAM_LOOKAHEAD_CHUNKS, audio_format: str = "wav",
+                         sample_format: str = None, sample_rate: int = None, seed: int = None,
+                         chunk_plan: str = STREAM_DEFAULT_CHUNK_PLAN,
+                         play_steps_policy: str = STREAM_DEFAULT_PLAY_STEPS_POLICY,
+                         trailing_silence_s: float = 0.0, use_cache: bool = True):
+        """Yields encoded audio frames. For any audio_format other than "wav" the
+        first item yielded is the stream format dict, before any audio. The last
+        item is {"stats": {...}} with per-request counters (not sent after a cancel).
+        Identical requests in flight on this container share one generation.
+        trailing_silence_s of silence is encoded after the audio (text sessions
+        use it as the gap between consecutive chunks). use_cache=False (benchmarks)
+        always generates, alone, and leaves the audio cache untouched.
+        
+        A seed (or DETERMINISTIC_MODE) gives the same audio as batch_synthesis with
+        that seed: the stream then runs uniform chunks and fixed play_steps whatever
+        chunk_plan and play_steps_policy say, without early stopping or silence
+        trimming. That costs the small first chunk's time-to-first-audio and the GPU
+        time early stopping saves; send no seed for the fastest stream."""
         import numpy as np
-        import soundfile as sf
-        import io
-        import time
-        from parler_tts import ParlerTTSStreamer
         
         logger = logging.getLogger(__name__)
         logger.info(f"🎵 [{request_id}] Starting streaming synthesis: '{text[:50]}...'")
         
-        # ✅ ADD CHUNKING
-        text_chunks = self.chunk_text(text, max_words=20)
-        logger.info(f"📝 [{request_id}] Split into {len(text_chunks)} chunks for streaming")
+        encoder = AudioStreamEncoder(audio_format, self.sampling_rate, sample_format, sample_rate)
+        if audio_format != "wav":
+            yield encoder.stream_format()
         
-        voice_description = VOICE_CONFIGS.get(voice_key, VOICE_CONFIGS["aryan_default"])
+        frame_rate = self.model.audio_encoder.config.frame_rate
+        play_steps = int(frame_rate * play_steps_in_s)
         
-        # ✅ PROCESS EACH CHUNK SEQUENTIALLY
-        for chunk_idx, chunk in enumerate(text_chunks):
-            logger.info(f"🔄 [{request_id}] Streaming chunk {chunk_idx+1}/{len(text_chunks)}: '{chunk[:30]}...'")
-            
-            # Tokenization for this chunk
-            text_tokens = self.tokenizer(chunk, return_tensors="pt").to(self.device)
-            desc_tokens = self.desc_tokenizer(voice_description, return_tensors="pt").to(self.device)
-            
-            # ✅ ADD HERE:
-            estimated_tokens = self.estimate_tokens_needed(chunk)
-            logger.info(f"🔍 [{request_id}] Text: '{chunk}' ({len(chunk.split())} words)")
-            logger.info(f"🔍 [{request_id}] Estimated tokens needed: {estimated_tokens}")
+        seed = self._resolve_seed(seed)
+        requested = (chunk_plan, play_steps_policy)
+        chunk_plan, play_steps_policy = seeded_stream_options(seed, chunk_plan, play_steps_policy)
+        if (chunk_plan, play_steps_policy) != requested:
+            logger.info(f"🎲 [{request_id}] Seed {seed}: {chunk_plan} chunks, {play_steps_policy} play_steps "
+                        f"for audio identical to batch_synthesis")
+        # Different chunk plans produce different audio for the same text
+        cache_key = AudioCache.make_key(text, resolve_voice_key(voice_key), SAMPLING_CONFIG, seed=seed,
+                                        chunk_plan=chunk_plan) if use_cache else None
+        cached_audio = self.audio_cache.get(cache_key) if use_cache else None
+        if cached_audio is not None:
+            # Replay in play_steps-sized frames, exactly like a live stream, with no model call
+            logger.info(f"💾 [{request_id}] Audio cache hit: {len(cached_audio)/self.sampling_rate:.3f}s, no generation")
+            block_samples = max(1, int(play_steps_in_s * self.sampling_rate))
+            for start in range(0, len(cached_audio), block_samples):
+                frame = encoder.encode(cached_audio[start:start + block_samples])
+                if frame:
+                    yield frame
             
-            # Setup streaming for this chunk
-            frame_rate = self.model.audio_encoder.config.frame_rate
-            play_steps = int(frame_rate * play_steps_in_s)
-            streamer = ParlerTTSStreamer(self.model, device=self.device, play_steps=play_steps)
+            if trailing_silence_s > 0:
+                frame = encoder.encode(np.zeros(int(trailing_silence_s * self.sampling_rate), dtype=np.float32))
+                if frame:
+                    yield frame
+            tail = encoder.flush()
+            if tail:
+                yield tail
+            self._publish_stats()
+            yield {"stats": {"response_cache_hit": True}}
+            return
+        
+        if self._cancel_requested(request_id):
+            logger.info(f"🛑 [{request_id}] Cancelled before start")
+            self._pop_cancellation(request_id)
+            return
+        
+        flight, replayed = self._join_stream(
+            cache_key, text, voice_key, play_steps, request_id, lookahead, seed, chunk_plan, play_steps_policy
+        )
+        # Set by _watch_cancellations
+        cancel_event = Event()
+        with self.watch_lock:
+            self.watched_streams[request_id] = (cancel_event, flight)
+        cancelled = False
+        
+        try:
+            for block in flight.follow(cancel_event):
+                frame = encoder.encode(block)
+                if frame:  # The resampler may hold back a very short block
+                    yield frame
             
-            generation_kwargs = {
-                "input_ids": desc_tokens.input_ids,
-                "attention_mask": desc_tokens.attention_mask,
-                "prompt_input_ids": text_tokens.input_ids,
-                "prompt_attention_mask": text_tokens.attention_mask,
-                "streamer": streamer,
-                "do_sample": True,        # ✅ Updated to match batch
-                "temperature": 1.0,       # ✅ Added temperature
-                "min_new_tokens": 5,       
-                "max_new_tokens": self.estimate_tokens_needed(chunk),    
-            }
+            cancelled = cancel_event.is_set()
+            if cancelled:
+                logger.info(f"🛑 [{request_id}] Stream cancelled")
+                return
             
-            # ✅ ADD HERE:
-            logger.info(f"🔍 [{request_id}] Generation config: min={generation_kwargs['min_new_tokens']}, max={generation_kwargs['max_new_tokens']}")
+            if trailing_silence_s > 0:
+                frame = encoder.encode(np.zeros(int(trailing_silence_s * self.sampling_rate), dtype=np.float32))
+                if frame:
+                    yield frame
+            tail = encoder.flush()
+            if tail:
+                yield tail
+            result = flight.result
+            logger.info(f"✅ [{request_id}] Streaming complete: {result.get('text_chunks', 0)} text chunks processed "
+                        f"({result.get('cached_chunks', 0)} cached, {result.get('generated_chunks', 0)} generated)")
             
-            torch.cuda.empty_cache()
+            yield {"stats": {
+                "response_cache_hit": False,
+                "coalesced": replayed is not None,
+                "replayed_blocks": replayed or 0,
+                "text_chunks": result.get("text_chunks", 0),
+                "cached_chunks": result.get("cached_chunks", 0),
+                "generated_chunks": result.get("generated_chunks", 0),
+                "play_steps_policy": play_steps_policy,
+                "play_steps_schedule_s": result.get("play_steps_schedule_s"),
+            }}
+        
+        finally:
+            # Last subscriber out (barge-in or disconnect) stops the shared generation
+            flight.detach()
+            with self.watch_lock:
+                self.watched_streams.pop(request_id, None)
+            # Also when not cancelled: one that landed after the last check must not
+            # cancel a later request reusing this id
+            self._pop_cancellation(request_id)
+            self._publish_stats()
+    
+    def _pop_cancellation(self, request_id: str):
+        try:
+            tts_cancellations.pop(request_id)
+        except Exception:
+            pass
+    
+    def _join_stream(self, cache_key: str, text: str, voice_key: str, play_steps: int, request_id: str,
+                     lookahead: int, seed, chunk_plan: str, play_steps_policy: str):
+        """Subscribe to the in-flight generation for this exact request, or start one.
+
+        Returns (flight, replayed): replayed is the number of blocks the subscriber
+        catches up on, or None if this call started the generation itself."""
+        logger = logging.getLogger(__name__)
+        # Block boundaries depend on the step policy, so only equal ones share a stream.
+        # Uncached requests (no cache_key) never share one.
+        flight_key = f"{cache_key or 'uncached:' + request_id}:{play_steps_policy}:{play_steps}"
+        
+        with self.inflight_lock:
+            flight = self.inflight.get(flight_key)
+            replayed = flight.attach() if flight is not None else None
+            if replayed is not None:
+                self.streams_coalesced += 1
+                logger.info(f"🔗 [{request_id}] Joined in-flight stream, replaying {replayed} blocks")
+                return flight, replayed
             
-            with torch.autocast(device_type=self.device, dtype=self.torch_dtype):
-                thread = Thread(target=self.model.generate, kwargs=generation_kwargs)
-                thread.start()
-                
-                # ✅ ADD THIS LINE before the streaming loop starts:
-                chunk_count = 0
-                total_samples = 0 
-                
-                try:
-                    for audio_chunk in streamer:
-                        if audio_chunk.shape[0] == 0:
-                            logger.info(f"🔍 [{request_id}] Streamer stopped yielding - chunk {chunk_count}")
-                            break
-                            
-                        chunk_count += 1  # ✅ Increment counter
-                        total_samples += audio_chunk.shape[0]  # ✅ Add this line
-                            
-                        # Convert to WAV and yield
-                        audio_float32 = audio_chunk.astype(np.float32)
-                        buffer = io.BytesIO()
-                        sf.write(buffer, audio_float32, self.sampling_rate, format='WAV')
-                        buffer.seek(0)
-                        wav_bytes = buffer.read()
-                        
-                        logger.info(f"🔍 [{request_id}] Chunk {chunk_count}: {audio_chunk.shape[0]} samples")  # ✅ Add this
-                        
-                        yield wav_bytes
-                        
-                finally:
-                    thread.join()
-                    
-                    # ✅ ADD HERE:
-                    logger.info(f"🔍 [{request_id}] Streaming complete: {chunk_count} audio chunks generated")
-                    logger.info(f"🔍 [{request_id}] Total tokens likely generated: ~{chunk_count * play_steps}")
-                    logger.info(f"🔍 [{request_id}] Expected tokens: {estimated_tokens}")
-                    logger.info(f"🔍 [{request_id}] Streaming total: {total_samples} samples across {chunk_count} chunks")  # ✅ Add this
-            
-            # ✅ ADD BRIEF SILENCE BETWEEN TEXT CHUNKS
-            if chunk_idx < len(text_chunks) - 1:  # Not the last chunk
-                silence_duration = 0.1  # 100ms silence
-                silence_samples = int(silence_duration * self.sampling_rate)
-                silence_audio = np.zeros(silence_samples, dtype=np.float32)
-                
-                buffer = io.BytesIO()
-                sf.write(buffer, silence_audio, self.sampling_rate, format='WAV')
-                buffer.seek(0)
-                yield buffer.read()
+            flight = CoalescedStream(flight_key)
+            flight.attach()
+            self.inflight[flight_key] = flight
+            self.streams_started += 1
+        
+        Thread(
+            target=self._produce_stream,
+            args=(flight, cache_key, text, voice_key, play_steps, request_id, lookahead, seed, chunk_plan,
+                  play_steps_policy),
+            daemon=True,
+        ).start()
+        return flight, None
+    
+    def _produce_stream(self, flight: CoalescedStream, cache_key: str, text: str, voice_key: str,
+                        play_steps: int, request_id: str, lookahead: int, seed, chunk_plan: str,
+                        play_steps_policy: str):
+        """Generate into flight for all of its subscribers; caches the response if complete"""
+        import numpy as np
+        
+        logger = logging.getLogger(__name__)
+        
+        # ✅ ADD CHUNKING
+        text_chunks = plan_text_chunks(text, chunk_plan)
+        logger.info(f"📝 [{request_id}] Split into {len(text_chunks)} chunks for streaming "
+                    f"(plan={chunk_plan}, lookahead={lookahead})")
         
-        logger.info(f"✅ [{request_id}] Streaming complete: {len(text_chunks)} text chunks processed")
+        # flight.cancel_event is set once every subscriber has gone (barge-in or disconnect):
+        # running generates stop on their next step and chunks not yet started are dropped
+        result = {"complete": False, "text_chunks": len(text_chunks)}
+        step_policy = None
+        if play_steps_policy == "adaptive":
+            step_policy = AdaptivePlaySteps(self.model.audio_encoder.config.frame_rate, self.sampling_rate)
+        
+        try:
+            for block in self._stream_audio_blocks(
+                text_chunks, voice_key, play_steps, request_id, lookahead, flight.cancel_event, result, seed,
+                step_policy, use_cache=cache_key is not None
+            ):
+                if step_policy is not None:
+                    step_policy.on_yield(len(block))
+                flight.publish(block)
+        except Exception as e:
+            logger.error(f"❌ [{request_id}] Stream generation failed: {e}")
+            result["complete"] = False
+        finally:
+            if step_policy is not None:
+                result["play_steps_schedule_s"] = step_policy.schedule
+                logger.info(f"📏 [{request_id}] Adaptive play_steps schedule (s): {step_policy.schedule}")
+            flight.finish(result)
+        
+        # Only cache complete responses - a dropped chunk would be replayed forever.
+        # The flight stays joinable until the cache has the audio.
+        if result["complete"] and cache_key is not None:
+            self._cache_audio(cache_key, np.concatenate(flight.blocks))
+        with self.inflight_lock:
+            if self.inflight.get(flight.key) is flight:
+                del self.inflight[flight.key]
 
 
-# In streaming_sanskrit_tts_optimized.py
+# Legacy proxy hop: websocket_server used to stream through this function, which
+# can cold-start a third container from the torch image just to forward bytes.
+# It now calls StreamingTTSService directly; this is kept for benchmark_stream_routes.
 @app.function(image=tts_image)
-def get_tts_stream(text: str, voice: str, play_steps_in_s: float, request_id: str):
+def get_tts_stream(text: str, voice: str, play_steps_in_s: float, request_id: str, audio_format: str = "wav",
+                   sample_format: str = None, sample_rate: int = None, seed: int = None,
+                   chunk_plan: str = STREAM_DEFAULT_CHUNK_PLAN,
+                   play_steps_policy: str = STREAM_DEFAULT_PLAY_STEPS_POLICY, use_cache: bool = True):
     tts_service = StreamingTTSService()
     # Use the asynchronous generator call here
     yield from tts_service.stream_synthesis.remote_gen(
-        text, voice, play_steps_in_s, request_id
+        text, voice, play_steps_in_s, request_id, audio_format=audio_format,
+        sample_format=sample_format, sample_rate=sample_rate, seed=seed, chunk_plan=chunk_plan,
+        play_steps_policy=play_steps_policy, use_cache=use_cache
     )
 
 
-output_vol = modal.Volume.from_name("tts-files", create_if_missing=True)
-
 @app.function(image=tts_image, volumes={"/output": output_vol})
 def test_batch(text: str):  # Remove default value
     import time
@@ -382,6 +3030,243 @@ def test_batch(text: str):  # Remove default value
     
     return f"File saved! Download with: modal volume get tts-files batch_output.wav"
 
+@app.function(image=tts_image, volumes={"/output": output_vol}, timeout=1800)
+def create_weight_snapshot(overwrite: bool = False):
+    """Write fp16 safetensors weights and both tokenizers to WEIGHT_SNAPSHOT_DIR.
+
+    Run with: modal run streaming_sanskrit_tts_optimized.py::create_weight_snapshot
+    An existing snapshot is kept only if it matches MODEL_ID and MODEL_REVISION (or
+    rebuilt regardless with --overwrite); load_model also starts a rebuild when it
+    finds a stale one.
+    """
+    import shutil
+    import torch
+    from parler_tts import ParlerTTSForConditionalGeneration
+    from transformers import AutoTokenizer
+    
+    # Containers that found the same stale snapshot each start a rebuild: the
+    # first one to finish makes the rest no-ops
+    output_vol.reload()
+    manifest = read_snapshot_manifest()
+    if snapshot_matches(manifest) and not overwrite:
+        print(f"✅ Snapshot already exists: {manifest}")
+        return manifest
+    if manifest is not None and not snapshot_matches(manifest):
+        print(f"♻️ Rebuilding snapshot of {manifest.get('model_id')}@{manifest.get('revision')} "
+              f"for {MODEL_ID}@{MODEL_REVISION}")
+    
+    start = time.perf_counter()
+    model = ParlerTTSForConditionalGeneration.from_pretrained(MODEL_ID, revision=MODEL_REVISION, torch_dtype=torch.float16)
+    tokenizer = AutoTokenizer.from_pretrained(MODEL_ID, revision=MODEL_REVISION)
+    desc_tokenizer = AutoTokenizer.from_pretrained(model.config.text_encoder._name_or_path)
+    
+    # Build next to the final path and swap in, so a container never sees half a snapshot
+    tmp_dir = f"{WEIGHT_SNAPSHOT_DIR}.{uuid.uuid4().hex[:8]}.tmp"
+    model.save_pretrained(tmp_dir, safe_serialization=True, max_shard_size="2GB")
+    tokenizer.save_pretrained(os.path.join(tmp_dir, "tokenizer"))
+    desc_tokenizer.save_pretrained(os.path.join(tmp_dir, "description_tokenizer"))
+    
+    manifest = {
+        "model_id": MODEL_ID,
+        "revision": MODEL_REVISION,
+        "dtype": "float16",
+        "created_at": time.time(),
+        "bytes": sum(
+            os.path.getsize(os.path.join(root, name))
+            for root, _, names in os.walk(tmp_dir) for name in names
+        ),
+    }
+    with open(os.path.join(tmp_dir, WEIGHT_SNAPSHOT_MANIFEST), "w") as f:
+        json.dump(manifest, f)
+    
+    if os.path.exists(WEIGHT_SNAPSHOT_DIR):
+        shutil.rmtree(WEIGHT_SNAPSHOT_DIR)
+    os.rename(tmp_dir, WEIGHT_SNAPSHOT_DIR)
+    output_vol.commit()
+    
+    print(f"✅ Snapshot written to {WEIGHT_SNAPSHOT_DIR} in {time.perf_counter() - start:.1f}s "
+          f"({manifest['bytes'] / (1024 ** 3):.2f} GB)")
+    return manifest
+
+
+@app.function(image=tts_image, gpu="L4", volumes={"/output": output_vol}, timeout=1800)
+def benchmark_weight_loading(repeats: int = 3):
+    """Load time (from_pretrained + transfer to GPU) for the hub checkpoint vs the fp16 snapshot.
+
+    Run create_weight_snapshot first, then:
+    modal run streaming_sanskrit_tts_optimized.py::benchmark_weight_loading
+    The first hub run includes the download, as it does on every cold start.
+    """
+    import gc
+    import torch
+    from parler_tts import ParlerTTSForConditionalGeneration
+    
+    if not snapshot_matches(read_snapshot_manifest()):
+        raise RuntimeError(f"No snapshot of {MODEL_ID}@{MODEL_REVISION} at {WEIGHT_SNAPSHOT_DIR}; "
+                           f"run create_weight_snapshot first")
+    
+    results = {"hub": [], "snapshot": []}
+    for i in range(repeats):
+        # Alternate the order so neither source always gets the warmer page cache
+        sources = (("hub", MODEL_ID), ("snapshot", WEIGHT_SNAPSHOT_DIR))
+        for name, source in (sources if i % 2 == 0 else sources[::-1]):
+            start = time.perf_counter()
+            model = ParlerTTSForConditionalGeneration.from_pretrained(
+                source, torch_dtype=torch.float16, low_cpu_mem_usage=True
+            ).to("cuda")
+            torch.cuda.synchronize()
+            results[name].append(time.perf_counter() - start)
+            del model
+            gc.collect()
+            torch.cuda.empty_cache()
+    
+    summary = {}
+    for name, timings in results.items():
+        summary[name] = {
+            "mean_s": sum(timings) / len(timings),
+            "min_s": min(timings),
+            "runs_s": timings,
+        }
+        print(f"⏱️ {name}: mean {summary[name]['mean_s']:.3f}s, min {summary[name]['min_s']:.3f}s")
+    summary["speedup"] = summary["hub"]["mean_s"] / summary["snapshot"]["mean_s"]
+    print(f"⏱️ Snapshot speedup: {summary['speedup']:.2f}x")
+    return summary
+
+
+@app.function(image=tts_image, timeout=1800)
+def benchmark_batch_modes(text: str, voice: str = "aryan_default", repeats: int = 3):
+    """Wall time of batched vs sequential batch_synthesis on the same text.
+
+    Runs bypass the audio cache (use_cache=False) so every one really generates.
+    A fresh seed per run would not do here: seeded requests always run sequentially.
+
+    Run with: modal run streaming_sanskrit_tts_optimized.py::benchmark_batch_modes --text "..."
+    """
+    import time
+    tts = StreamingTTSService()
+    
+    # First call absorbs container start + compile so it doesn't skew either mode
+    tts.batch_synthesis.remote(text, voice, "bench_warmup", True, use_cache=False)
+    
+    results = {}
+    for batched in (False, True):
+        timings = []
+        generate_s = []
+        for i in range(repeats):
+            start = time.perf_counter()
+            response = tts.batch_synthesis.remote(text, voice, f"bench_{i}", batched, use_cache=False, return_stats=True)
+            timings.append(time.perf_counter() - start)
+            generate_s.append(response["stats"]["generate_s"])
+        mode = "batched" if batched else "sequential"
+        results[mode] = {
+            "mean_s": sum(timings) / len(timings),
+            "min_s": min(timings),
+            "runs_s": timings,
+            # Server-side generate time only, without the call round trip and WAV encoding
+            "generate_mean_s": sum(generate_s) / len(generate_s),
+        }
+        print(f"⏱️ {mode}: mean {results[mode]['mean_s']:.3f}s, min {results[mode]['min_s']:.3f}s, "
+              f"generate mean {results[mode]['generate_mean_s']:.3f}s")
+    
+    results["speedup"] = results["sequential"]["mean_s"] / results["batched"]["mean_s"]
+    print(f"⏱️ Batched speedup: {results['speedup']:.2f}x")
+    # Both modes must have run on the graphs warmup built
+    check_compile_steady_state(tts.service_stats.remote()["compile"])
+    return results
+
+@app.function(image=websocket_image, timeout=1800)
+def benchmark_stream_routes(text: str, voice: str = "aryan_default", runs: int = 5,
+                            gap_s: float = 0.0, cold_start_threshold_s: float = 5.0):
+    """Time-to-first-chunk and cold starts: via the get_tts_stream proxy vs calling
+    StreamingTTSService.stream_synthesis directly (what websocket_server does now).
+
+    Cold starts are counted as runs whose first chunk took longer than
+    cold_start_threshold_s. Use gap_s larger than the idle timeouts to force them.
+    Runs are unseeded, so they measure the default chunk plan and play_steps policy
+    (a seed forces uniform/fixed), and bypass the audio cache (use_cache=False).
+
+    Run with: modal run streaming_sanskrit_tts_optimized.py::benchmark_stream_routes --text "..."
+    """
+    routes = {
+        "proxy": lambda request_id: get_tts_stream.remote_gen(text, voice, 0.5, request_id, use_cache=False),
+        "direct": lambda request_id: StreamingTTSService().stream_synthesis.remote_gen(
+            text, voice, 0.5, request_id, use_cache=False
+        ),
+    }
+    
+    results = {}
+    for route, open_stream in routes.items():
+        first_chunk_s = []
+        total_s = []
+        for i in range(runs):
+            if gap_s:
+                time.sleep(gap_s)
+            start = time.perf_counter()
+            first = None
+            for item in open_stream(f"bench_{route}_{i}"):
+                if first is None and isinstance(item, bytes):
+                    first = time.perf_counter() - start
+            total_s.append(time.perf_counter() - start)
+            first_chunk_s.append(first if first is not None else total_s[-1])
+        
+        warm = sorted(t for t in first_chunk_s if t <= cold_start_threshold_s)
+        results[route] = {
+            "first_chunk_s": first_chunk_s,
+            "total_s": total_s,
+            "cold_starts": sum(1 for t in first_chunk_s if t > cold_start_threshold_s),
+            "warm_first_chunk_median_s": warm[len(warm) // 2] if warm else None,
+        }
+        print(f"⏱️ {route}: first chunk {['%.3f' % t for t in first_chunk_s]}, cold starts {results[route]['cold_starts']}")
+    
+    return results
+
+
+@app.function(image=websocket_image, timeout=1800)
+def benchmark_chunk_plans(text: str, voice: str = "aryan_default", runs: int = 5, play_steps_in_s: float = 0.5):
+    """Time-to-first-audio for each chunk plan (see CHUNK_PLANS) under each play_steps
+    policy (see PLAY_STEPS_POLICIES), side by side on the same text.
+
+    Runs are unseeded - a seed would force the uniform plan and the fixed policy -
+    and bypass the audio cache (use_cache=False), so each one really generates.
+
+    Run with: modal run streaming_sanskrit_tts_optimized.py::benchmark_chunk_plans --text "..."
+    """
+    tts = StreamingTTSService()
+    
+    # First call absorbs container start + compile so it doesn't skew any combination
+    for _ in tts.stream_synthesis.remote_gen(text, voice, play_steps_in_s, "bench_warmup", use_cache=False):
+        pass
+    
+    results = {}
+    for chunk_plan in CHUNK_PLANS:
+        results[chunk_plan] = {"plan": describe_chunk_plan(text, chunk_plan)}
+        for policy in PLAY_STEPS_POLICIES:
+            first_audio_s = []
+            total_s = []
+            for i in range(runs):
+                start = time.perf_counter()
+                first = None
+                for item in tts.stream_synthesis.remote_gen(
+                    text, voice, play_steps_in_s, f"bench_{chunk_plan}_{policy}_{i}", chunk_plan=chunk_plan,
+                    play_steps_policy=policy, use_cache=False
+                ):
+                    if first is None and isinstance(item, bytes):
+                        first = time.perf_counter() - start
+                total_s.append(time.perf_counter() - start)
+                first_audio_s.append(first if first is not None else total_s[-1])
+            
+            ordered = sorted(first_audio_s)
+            results[chunk_plan][policy] = {
+                "first_audio_s": first_audio_s,
+                "first_audio_median_s": ordered[len(ordered) // 2],
+                "total_s": total_s,
+            }
+            print(f"⏱️ {chunk_plan} / {policy}: words per chunk {results[chunk_plan]['plan']['words_per_chunk']}, "
+                  f"first audio median {results[chunk_plan][policy]['first_audio_median_s']:.3f}s, "
+                  f"runs {['%.3f' % t for t in first_audio_s]}")
+    
+    return results
+
 # WebSocket Server Container
 @app.function(
     image=websocket_image,
@@ -391,6 +3276,11 @@ def test_batch(text: str):  # Remove default value
 )
 @modal.asgi_app()
 def websocket_server():
+    """Browser-facing stream_tts / tts_begin sessions (see deploy() for the messages).
+
+    stream_start reports the chunk plan and play_steps policy a stream actually runs:
+    with a seed they are uniform and fixed, whatever was asked for - reproducible
+    audio, at the cost of the small first chunk and the adaptive first emission."""
     from fastapi import FastAPI, WebSocket, WebSocketDisconnect
     
     logging.basicConfig(level=logging.INFO)
@@ -400,13 +3290,295 @@ def websocket_server():
     
     @web_app.websocket("/")
     async def websocket_endpoint(websocket: WebSocket):
+        import asyncio
+        
         await websocket.accept()
         client_id = f"client_{id(websocket)}"
         logger.info(f"✅ WebSocket client {client_id} connected")
         
-        # ✅ CREATE SINGLE REUSABLE INSTANCE
+        # ✅ CREATE SINGLE REUSABLE INSTANCE - called directly, no proxy function in between
         tts_service = StreamingTTSService()
         
+        # Full duplex: this coroutine only reads, one writer task owns all sends,
+        # and every stream_tts runs as its own task keyed in `requests`
+        outbox = asyncio.Queue(maxsize=OUTBOX_MAX_MESSAGES)
+        requests = {}
+        # Incremental text sessions: session_id -> chunker, stream options and the
+        # queue of released chunks its worker task turns into ordered streams
+        sessions = {}
+        
+        async def send_json(payload: dict):
+            await outbox.put(json.dumps(payload))
+        
+        async def write_messages():
+            while True:
+                message = await outbox.get()
+                if isinstance(message, bytes):
+                    await websocket.send_bytes(message)
+                else:
+                    await websocket.send_text(message)
+        
+        async def cancel_request(request_id: str):
+            request = requests.get(request_id)
+            if request is None or request["cancelled"]:
+                return False
+            request["cancelled"] = True
+            await tts_cancellations.put.aio(request_id, time.time())
+            return True
+        
+        async def prefetch(stream, buffered: asyncio.Queue):
+            """Read a remote stream into buffered, ending with None (or the exception)"""
+            try:
+                async for item in stream:
+                    await buffered.put(item)
+                await buffered.put(None)
+            except Exception as e:
+                await buffered.put(e)
+        
+        async def replay(buffered: asyncio.Queue):
+            while True:
+                item = await buffered.get()
+                if item is None:
+                    return
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        
+        async def run_stream(request_id: str, text: str, options: dict, previous=None,
+                             session_id: str = None, trailing_silence_s: float = 0.0):
+            request = requests[request_id]
+            chunk_count = 0
+            audio_format = options["audio_format"]
+            # Tagged frames lead with the ASCII request_id so interleaved streams can be told apart
+            frame_prefix = request_id.encode("ascii") if options["tagged_frames"] else b""
+            session_tag = {"session_id": session_id} if session_id else {}
+            pump = None
+            
+            try:
+                # ADD THIS DEBUG STATEMENT
+                logger.info(f"🔍 [{client_id}] Attempting to get stream from TTS service...")
+                
+                audio_stream = tts_service.stream_synthesis.remote_gen.aio(
+                    text, options["voice"], options["play_steps_in_s"], request_id,
+                    audio_format=audio_format, sample_format=options["sample_format"],
+                    sample_rate=options["sample_rate"], seed=options["seed"], chunk_plan=options["chunk_plan"],
+                    play_steps_policy=options["play_steps_policy"], trailing_silence_s=trailing_silence_s
+                )
+                
+                if previous is not None:
+                    # Session chunk: synthesize now, but hold the audio until the
+                    # previous chunk has gone out so the client hears them in order
+                    buffered = asyncio.Queue()
+                    pump = asyncio.create_task(prefetch(audio_stream, buffered))
+                    audio_stream = replay(buffered)
+                    await asyncio.wait({previous})
+                    if request["cancelled"]:
+                        return
+                
+                # Headerless formats: the TTS service leads with the format
+                # descriptor, which the client gets once in stream_start
+                stream_format = {"encoding": "wav"}
+                if audio_format != "wav":
+                    stream_format = await audio_stream.__anext__()
+                
+                await send_json({
+                    "type": "stream_start",
+                    "request_id": request_id,
+                    **session_tag,
+                    "text": text,
+                    "voice": options["voice"],
+                    "estimated_duration": estimate_audio_duration(text),
+                    "audio_format": stream_format,
+                    "tagged_frames": options["tagged_frames"],
+                    # Same pure-Python chunker the TTS service runs, so no extra round trip
+                    "chunk_plan": describe_chunk_plan(text, options["chunk_plan"]),
+                    # A seed overrides the requested plan and policy (seeded_stream_options)
+                    "play_steps_policy": options["play_steps_policy"],
+                })
+                
+                stream_stats = {}
+                async for wav_chunk in audio_stream:
+                    if request["cancelled"]:
+                        # Stop forwarding now; the TTS container stops generating
+                        # on its next cancel check
+                        break
+                    if isinstance(wav_chunk, dict):
+                        # Per-request counters from the TTS service, reported in stream_complete
+                        stream_stats.update(wav_chunk.get("stats", {}))
+                        continue
+                    
+                    logger.info(f"🔊 [{client_id}] [{request_id}] Received chunk {chunk_count+1} from TTS service. Size: {len(wav_chunk)} bytes")
+                    chunk_count += 1
+                    await outbox.put(frame_prefix + wav_chunk)
+                
+                if request["cancelled"]:
+                    logger.info(f"🛑 [{client_id}] Stream {request_id} cancelled after {chunk_count} chunks.")
+                    await send_json({
+                        "type": "stream_cancelled",
+                        "request_id": request_id,
+                        **session_tag,
+                        "total_chunks": chunk_count
+                    })
+                    return
+                
+                logger.info(f"✅ [{client_id}] [{request_id}] Streaming complete. Sent {chunk_count} chunks.")
+                await send_json({
+                    "type": "stream_complete",
+                    "request_id": request_id,
+                    **session_tag,
+                    "total_chunks": chunk_count,
+                    "stats": stream_stats
+                })
+                
+            except Exception as e:
+                logger.error(f"❌ [{client_id}] Error [{request_id}]: {str(e)}")
+                await send_json({
+                    "type": "error",
+                    "request_id": request_id,
+                    **session_tag,
+                    "message": str(e)
+                })
+            finally:
+                if pump is not None:
+                    pump.cancel()
+                requests.pop(request_id, None)
+        
+        def start_stream(text: str, options: dict, **kwargs) -> str:
+            request_id = str(uuid.uuid4())[:REQUEST_ID_LENGTH]
+            requests[request_id] = {"cancelled": False}
+            requests[request_id]["task"] = asyncio.create_task(run_stream(request_id, text, options, **kwargs))
+            return request_id
+        
+        async def handle_stream_tts(data: dict):
+            text = data.get("text", "").strip()
+            if not text:
+                await send_json({
+                    "type": "error",
+                    "message": "Text required"
+                })
+                return
+            
+            options, error = parse_stream_options(data)
+            if error:
+                await send_json({
+                    "type": "error",
+                    "message": error
+                })
+                return
+            
+            start_stream(text, options)
+        
+        async def run_session(session_id: str):
+            """Turn a session's released chunks into streams, in order, at most
+            SESSION_LOOKAHEAD_CHUNKS ahead of the one being forwarded"""
+            session = sessions[session_id]
+            # Each chunk is already cut by the session chunker - don't re-split it
+            options = dict(session["options"], chunk_plan="uniform")
+            in_flight = deque()
+            previous = None
+            try:
+                while True:
+                    item = await session["chunks"].get()
+                    if item is None:
+                        break
+                    text, trailing_silence_s = item
+                    while len(in_flight) > SESSION_LOOKAHEAD_CHUNKS:
+                        await asyncio.wait({in_flight.popleft()})
+                    request_id = start_stream(text, options, previous=previous, session_id=session_id,
+                                              trailing_silence_s=trailing_silence_s)
+                    session["request_ids"].append(request_id)
+                    previous = requests[request_id]["task"]
+                    in_flight.append(previous)
+                
+                if previous is not None:
+                    await asyncio.wait({previous})
+                logger.info(f"✅ [{client_id}] Session {session_id} complete: {len(session['request_ids'])} chunks")
+                await send_json({
+                    "type": "session_complete",
+                    "session_id": session_id,
+                    "request_ids": session["request_ids"],
+                    "total_chunks": len(session["request_ids"])
+                })
+            finally:
+                sessions.pop(session_id, None)
+        
+        async def handle_tts_begin(data: dict):
+            options, error = parse_stream_options(data)
+            if error is None and options["audio_format"] == "opus":
+                # Every chunk is its own request, and so its own Ogg stream
+                error = "audio_format 'opus' is not supported for text sessions, use pcm or wav"
+            if error:
+                await send_json({
+                    "type": "error",
+                    "message": error
+                })
+                return
+            
+            session_id = str(uuid.uuid4())[:REQUEST_ID_LENGTH]
+            first_max_words = FIRST_CHUNK_MAX_WORDS if options["chunk_plan"] == "small_first" else None
+            sessions[session_id] = {
+                "options": options,
+                "chunker": IncrementalChunker(first_max_words=first_max_words),
+                "chunks": asyncio.Queue(),
+                "request_ids": [],
+                "ended": False,
+            }
+            sessions[session_id]["worker"] = asyncio.create_task(run_session(session_id))
+            await send_json({
+                "type": "session_started",
+                "session_id": session_id
+            })
+        
+        async def session_for(data: dict):
+            session_id = data.get("session_id")
+            session = sessions.get(session_id)
+            if session is None or session["ended"]:
+                await send_json({
+                    "type": "error",
+                    "session_id": session_id,
+                    "message": "No open text session with that session_id"
+                })
+                return None
+            return session
+        
+        async def handle_tts_append_text(data: dict):
+            session = await session_for(data)
+            if session is None:
+                return
+            text = data.get("text", "")
+            if not isinstance(text, str):
+                await send_json({
+                    "type": "error",
+                    "session_id": data.get("session_id"),
+                    "message": "text must be a string"
+                })
+                return
+            for chunk in session["chunker"].append(text):
+                await session["chunks"].put((chunk, SESSION_CHUNK_GAP_S))
+        
+        async def handle_tts_end(data: dict):
+            session = await session_for(data)
+            if session is None:
+                return
+            session["ended"] = True
+            chunks = session["chunker"].flush()
+            for i, chunk in enumerate(chunks):
+                # No gap after the very end of the reply
+                await session["chunks"].put((chunk, SESSION_CHUNK_GAP_S if i < len(chunks) - 1 else 0.0))
+            await session["chunks"].put(None)
+        
+        async def cancel_session(session_id: str):
+            session = sessions.pop(session_id, None)
+            if session is None:
+                return False
+            session["ended"] = True
+            session["worker"].cancel()
+            for request_id in session["request_ids"]:
+                await cancel_request(request_id)
+            return True
+        
+        writer = asyncio.create_task(write_messages())
+        
         try:
             while True:
                 message_text = await websocket.receive_text()
@@ -416,73 +3588,385 @@ def websocket_server():
                 logger.info(f"📥 [{client_id}] {message_type}")
                 
                 if message_type == "health_check":
-                    await websocket.send_text(json.dumps({
+                    # Read what the TTS containers published rather than calling them,
+                    # so a health check never cold-starts a GPU
+                    try:
+                        container_stats = [stats async for _, stats in tts_service_stats.items.aio()]
+                        service_report = summarize_service_stats(container_stats)
+                    except Exception as e:
+                        logger.warning(f"⚠️ [{client_id}] Could not read TTS service stats: {e}")
+                        service_report = None
+                    
+                    await send_json({
                         "type": "health_response", 
                         "status": "healthy",
-                        "available_voices": list(VOICE_CONFIGS.keys())
-                    }))
+                        "available_voices": list(VOICE_CONFIGS.keys()),
+                        "active_requests": list(requests.keys()),
+                        "tts_service": service_report
+                    })
                     
                 elif message_type == "stream_tts":
-                    text = data.get("text", "").strip()
-                    voice = data.get("voice", "aryan_default")
-                    play_steps_in_s = data.get("play_steps_in_s", 0.5)
-                    
-                    if not text:
-                        await websocket.send_text(json.dumps({
+                    await handle_stream_tts(data)
+                
+                elif message_type == "tts_begin":
+                    await handle_tts_begin(data)
+                
+                elif message_type == "tts_append_text":
+                    await handle_tts_append_text(data)
+                
+                elif message_type == "tts_end":
+                    await handle_tts_end(data)
+                
+                elif message_type == "cancel_tts" and data.get("session_id"):
+                    session_id = data["session_id"]
+                    if await cancel_session(session_id):
+                        await send_json({
+                            "type": "session_cancelled",
+                            "session_id": session_id
+                        })
+                    else:
+                        await send_json({
                             "type": "error",
-                            "message": "Text required"
-                        }))
-                        continue
-                    
-                    request_id = str(uuid.uuid4())[:8]
-                    estimated_duration = estimate_audio_duration(text)
-                    
-                    await websocket.send_text(json.dumps({
-                        "type": "stream_start",
-                        "request_id": request_id,
-                        "text": text,
-                        "voice": voice,
-                        "estimated_duration": estimated_duration
-                    }))
-                    
-                    try:
-                        chunk_count = 0
-                        
-                        # ADD THIS DEBUG STATEMENT
-                        logger.info(f"🔍 [{client_id}] Attempting to get stream from TTS service...")
-                        
-                        # ✅ REUSE EXISTING INSTANCE
-                        async for wav_chunk in get_tts_stream.remote_gen.aio(
-                            text, voice, play_steps_in_s, request_id
-                        ):
-                            
-                            # ADD THIS DEBUG STATEMENT
-                            logger.info(f"🔊 [{client_id}] Received chunk {chunk_count+1} from TTS service. Size: {len(wav_chunk)} bytes")
-                            chunk_count += 1
-                            await websocket.send_bytes(wav_chunk)
-                        
-                        logger.info(f"✅ [{client_id}] Streaming complete. Sent {chunk_count} chunks.")
-
-                        
-                        await websocket.send_text(json.dumps({
-                            "type": "stream_complete",
-                            "request_id": request_id,
-                            "total_chunks": chunk_count
-                        }))
-                        
-                    except Exception as e:
-                        logger.error(f"❌ [{client_id}] Error [{request_id}]: {str(e)}")
-                        await websocket.send_text(json.dumps({
+                            "session_id": session_id,
+                            "message": "No open text session with that session_id"
+                        })
+                
+                elif message_type == "cancel_tts":
+                    request_id = data.get("request_id")
+                    if not await cancel_request(request_id):
+                        await send_json({
                             "type": "error",
                             "request_id": request_id,
-                            "message": str(e)
-                        }))
+                            "message": "No active stream with that request_id"
+                        })
                     
         except WebSocketDisconnect:
             logger.info(f"👋 Client {client_id} disconnected")
         except Exception as e:
             logger.error(f"💥 WebSocket error [{client_id}]: {str(e)}")
+        finally:
+            # Nobody is listening any more - stop every generation this socket started
+            for session in list(sessions.values()):
+                session["worker"].cancel()
+            for request_id, request in list(requests.items()):
+                await cancel_request(request_id)
+                request["task"].cancel()
+            writer.cancel()
+            
+    return web_app
+    
+# Fly -> client fan-out gateway (server/modules/runpod_tts.js)
+@app.function(
+    image=websocket_image,
+    concurrency_limit=1,  # One container: the client registry below is in-process
+    allow_concurrent_inputs=GATEWAY_MAX_CONNECTIONS,
+    keep_warm=0,
+    timeout=1800
+)
+@modal.asgi_app()
+def tts_gateway():
+    """The Fly server sends tts_request {request_id, client_id, text, voice, play_steps_in_s}
+    on /fly; the audio goes straight to the browser's own socket on /client/{client_id}
+    (stream_start, binary frames, stream_complete - as on websocket_server, including
+    the seeded override of chunk_plan and play_steps_policy), and Fly gets
+    tts_complete / tts_error back."""
+    import asyncio
+    from fastapi import FastAPI, WebSocket, WebSocketDisconnect
+    
+    logging.basicConfig(level=logging.INFO)
+    logger = logging.getLogger(__name__)
+    
+    web_app = FastAPI()
+    tts_service = StreamingTTSService()
+    
+    # client_id -> {"websocket", "outbox", "requests", "connected_at", "frames_sent"}
+    clients = {}
+    last_publish = 0.0
+    
+    def client_report() -> list:
+        return [{
+            "client_id": client_id,
+            "queue_depth": client["outbox"].qsize(),
+            "queue_max": OUTBOX_MAX_MESSAGES,
+            "active_requests": list(client["requests"].keys()),
+            "frames_sent": client["frames_sent"],
+            "connected_s": round(time.time() - client["connected_at"], 1),
+        } for client_id, client in clients.items()]
+    
+    async def publish_clients(force: bool = False):
+        """Push per-client queue depth to tts_gateway_stats, at most every STATS_PUBLISH_INTERVAL_S"""
+        nonlocal last_publish
+        now = time.time()
+        if not force and now - last_publish < STATS_PUBLISH_INTERVAL_S:
+            return
+        last_publish = now
+        try:
+            await tts_gateway_stats.put.aio("clients", {"published_at": now, "clients": client_report()})
+        except Exception as e:
+            logger.warning(f"⚠️ Could not publish gateway client stats: {e}")
+    
+    async def wait_for_client(client_id: str):
+        # The browser may open its audio socket just after Fly sends the request
+        deadline = time.time() + GATEWAY_CLIENT_CONNECT_TIMEOUT_S
+        while client_id not in clients and time.time() < deadline:
+            await asyncio.sleep(0.05)
+        return clients.get(client_id)
+    
+    async def cancel_request(client: dict, request_id: str):
+        request = client["requests"].get(request_id)
+        if request is None or request["cancelled"]:
+            return False
+        request["cancelled"] = True
+        await tts_cancellations.put.aio(request_id, time.time())
+        return True
+    
+    async def run_request(client: dict, client_id: str, request_id: str, text: str, options: dict,
+                          notify):
+        request = client["requests"][request_id]
+        outbox = client["outbox"]
+        chunk_count = 0
+        
+        try:
+            audio_stream = tts_service.stream_synthesis.remote_gen.aio(
+                text, options["voice"], options["play_steps_in_s"], request_id,
+                audio_format=options["audio_format"], sample_format=options["sample_format"],
+                sample_rate=options["sample_rate"], seed=options["seed"], chunk_plan=options["chunk_plan"],
+                play_steps_policy=options["play_steps_policy"]
+            )
+            
+            stream_format = {"encoding": "wav"}
+            if options["audio_format"] != "wav":
+                stream_format = await audio_stream.__anext__()
+            
+            await outbox.put(json.dumps({
+                "type": "stream_start",
+                "request_id": request_id,
+                "text": text,
+                "voice": options["voice"],
+                "estimated_duration": estimate_audio_duration(text),
+                "audio_format": stream_format,
+                "tagged_frames": False,
+                "chunk_plan": describe_chunk_plan(text, options["chunk_plan"]),
+                "play_steps_policy": options["play_steps_policy"],
+            }))
+            
+            stream_stats = {}
+            async for wav_chunk in audio_stream:
+                if request["cancelled"]:
+                    break
+                if isinstance(wav_chunk, dict):
+                    stream_stats.update(wav_chunk.get("stats", {}))
+                    continue
+                chunk_count += 1
+                # A slow browser only backs up its own outbox, never another client's
+                await outbox.put(wav_chunk)
+                await publish_clients()
+            
+            if request["cancelled"]:
+                logger.info(f"🛑 [{client_id}] [{request_id}] Cancelled after {chunk_count} chunks")
+                await outbox.put(json.dumps({
+                    "type": "stream_cancelled",
+                    "request_id": request_id,
+                    "total_chunks": chunk_count
+                }))
+                await notify({"type": "tts_cancelled", "request_id": request_id, "client_id": client_id})
+                return
+            
+            logger.info(f"✅ [{client_id}] [{request_id}] Streamed {chunk_count} chunks to client")
+            await outbox.put(json.dumps({
+                "type": "stream_complete",
+                "request_id": request_id,
+                "total_chunks": chunk_count,
+                "stats": stream_stats
+            }))
+            await notify({
+                "type": "tts_complete",
+                "request_id": request_id,
+                "client_id": client_id,
+                "total_chunks": chunk_count
+            })
+        
+        except Exception as e:
+            logger.error(f"❌ [{client_id}] Error [{request_id}]: {str(e)}")
+            await outbox.put(json.dumps({
+                "type": "error",
+                "request_id": request_id,
+                "message": str(e)
+            }))
+            await notify({"type": "tts_error", "request_id": request_id, "client_id": client_id,
+                          "message": str(e)})
+        finally:
+            client["requests"].pop(request_id, None)
+    
+    @web_app.websocket("/client/{client_id}")
+    async def client_endpoint(websocket: WebSocket, client_id: str):
+        await websocket.accept()
+        
+        previous = clients.get(client_id)
+        if previous is not None:
+            # Reconnect with the same id: the new socket takes over, the old one's streams stop
+            logger.info(f"🔁 Client {client_id} reconnected, closing its previous socket")
+            for request_id in list(previous["requests"]):
+                await cancel_request(previous, request_id)
+            previous["writer"].cancel()
+            try:
+                await previous["websocket"].close()
+            except Exception:
+                pass
+        
+        client = {
+            "websocket": websocket,
+            "outbox": asyncio.Queue(maxsize=OUTBOX_MAX_MESSAGES),
+            "requests": {},
+            "connected_at": time.time(),
+            "frames_sent": 0,
+        }
+        
+        async def write_messages():
+            while True:
+                message = await client["outbox"].get()
+                if isinstance(message, bytes):
+                    await websocket.send_bytes(message)
+                    client["frames_sent"] += 1
+                else:
+                    await websocket.send_text(message)
+        
+        client["writer"] = asyncio.create_task(write_messages())
+        clients[client_id] = client
+        logger.info(f"✅ Audio client {client_id} connected ({len(clients)} connected)")
+        await publish_clients(force=True)
+        
+        try:
+            while True:
+                data = json.loads(await websocket.receive_text())
+                if data.get("type") == "cancel_tts":
+                    # Barge-in straight from the browser
+                    request_id = data.get("request_id")
+                    if not await cancel_request(client, request_id):
+                        await client["outbox"].put(json.dumps({
+                            "type": "error",
+                            "request_id": request_id,
+                            "message": "No active stream with that request_id"
+                        }))
+        
+        except WebSocketDisconnect:
+            logger.info(f"👋 Audio client {client_id} disconnected")
+        except Exception as e:
+            logger.error(f"💥 Audio client error [{client_id}]: {str(e)}")
+        finally:
+            if clients.get(client_id) is client:
+                clients.pop(client_id)
+            for request_id, request in list(client["requests"].items()):
+                await cancel_request(client, request_id)
+                request["task"].cancel()
+            client["writer"].cancel()
+            await publish_clients(force=True)
+    
+    @web_app.websocket("/fly")
+    async def fly_endpoint(websocket: WebSocket):
+        await websocket.accept()
+        control_id = f"fly_{id(websocket)}"
+        logger.info(f"✅ Fly control socket {control_id} connected")
+        
+        send_lock = asyncio.Lock()
+        
+        async def notify(payload: dict):
+            # Request tasks outlive a dropped control socket; their notices are best effort
+            try:
+                async with send_lock:
+                    await websocket.send_text(json.dumps(payload))
+            except Exception:
+                pass
+        
+        async def handle_tts_request(data: dict):
+            request_id = str(data.get("request_id") or uuid.uuid4())
+            client_id = data.get("client_id")
+            text = data.get("text", "").strip()
+            
+            options, error = parse_stream_options(data)
+            if error is None and not text:
+                error = "Text required"
+            if error is None and not client_id:
+                error = "client_id required"
+            
+            client = None
+            if error is None:
+                client = await wait_for_client(client_id)
+                if client is None:
+                    error = f"Client {client_id} has no audio socket connected"
             
+            if error:
+                logger.warning(f"⚠️ [{control_id}] Rejected {request_id}: {error}")
+                await notify({"type": "tts_error", "request_id": request_id, "client_id": client_id,
+                              "message": error})
+                return
+            
+            logger.info(f"📤 [{control_id}] {request_id} -> {client_id}: '{text[:50]}...'")
+            client["requests"][request_id] = {"cancelled": False}
+            client["requests"][request_id]["task"] = asyncio.create_task(
+                run_request(client, client_id, request_id, text, options, notify)
+            )
+        
+        pending = set()
+        try:
+            while True:
+                data = json.loads(await websocket.receive_text())
+                message_type = data.get("type")
+                logger.info(f"📥 [{control_id}] {message_type}")
+                
+                if message_type == "tts_request":
+                    # Waiting for a late audio socket must not hold up the next message
+                    task = asyncio.create_task(handle_tts_request(data))
+                    pending.add(task)
+                    task.add_done_callback(pending.discard)
+                
+                elif message_type == "health_check":
+                    try:
+                        container_stats = [stats async for _, stats in tts_service_stats.items.aio()]
+                        service_report = summarize_service_stats(container_stats)
+                    except Exception as e:
+                        logger.warning(f"⚠️ [{control_id}] Could not read TTS service stats: {e}")
+                        service_report = None
+                    
+                    await notify({
+                        "type": "health_response",
+                        "status": "healthy",
+                        "available_voices": list(VOICE_CONFIGS.keys()),
+                        "connected_clients": len(clients),
+                        "tts_service": service_report
+                    })
+                
+                elif message_type == "get_connected_clients":
+                    await notify({
+                        "type": "connected_clients",
+                        "clients": client_report()
+                    })
+                
+                elif message_type == "cancel_tts":
+                    request_id = data.get("request_id")
+                    client = clients.get(data.get("client_id"))
+                    if client is None or not await cancel_request(client, request_id):
+                        await notify({
+                            "type": "error",
+                            "request_id": request_id,
+                            "message": "No active stream with that request_id and client_id"
+                        })
+                
+                else:
+                    await notify({
+                        "type": "error",
+                        "message": f"Unknown message type '{message_type}'"
+                    })
+        
+        except WebSocketDisconnect:
+            logger.info(f"👋 Fly control socket {control_id} disconnected")
+        except Exception as e:
+            logger.error(f"💥 Fly control socket error [{control_id}]: {str(e)}")
+        finally:
+            # Streams already routed to clients keep playing; only unrouted requests stop
+            for task in list(pending):
+                task.cancel()
+    
     return web_app
     
 # Deploy test
@@ -491,3 +3975,43 @@ def deploy():
     print("🚀 Two-container streaming TTS ready!")
     print("WebSocket URL: Use the websocket_server endpoint")
     print("Protocol: {'type': 'stream_tts', 'text': 'ॐ गम् गणपतये नमः', 'voice': 'aryan_default'}")
+    print("Optional: 'audio_format': 'pcm' for one format header in stream_start + raw LE frames")
+    print("Optional: 'audio_codec': 'opus' for one continuous Ogg/Opus stream")
+    print("Barge-in: {'type': 'cancel_tts', 'request_id': <id from stream_start>}")
+    print("Text sessions (LLM output): {'type': 'tts_begin', 'voice': ...} -> session_started {session_id}, then")
+    print("  {'type': 'tts_append_text', 'session_id': ..., 'text': <tokens>} as text arrives, {'type': 'tts_end', 'session_id': ...}")
+    print("  Each sentence streams as soon as it is complete; cancel_tts with 'session_id' stops the whole session")
+    print("Reproducible audio: 'seed': <int> (same text + voice + seed -> identical audio, streamed or batch; "
+          "seeded streams run uniform chunks, fixed play_steps and no early stopping, so they start slower)")
+    print("Optional: 'chunk_plan': 'small_first' (default, short first chunk) | 'uniform'")
+    print("Optional: 'play_steps_policy': 'adaptive' (default, small first emission, then growing) | 'fixed'")
+    print("Concurrent streams: 'tagged_frames': true prefixes each binary frame with its 8-byte request_id")
+    print("Optional: 'sample_format': 'f32' | 's16', 'sample_rate': 8000-48000 (resampled server-side)")
+    print("Fly gateway: tts_gateway endpoint - Fly connects to /fly and sends tts_request with client_id;")
+    print("  each browser connects to /client/<client_id> and receives its own audio directly")
+
+
+@app.function(image=websocket_image)
+def benchmark_chunker(repeats: int = 2000, max_words: int = CHUNK_MAX_WORDS):
+    """Speed and chunk shape of chunk_sanskrit_text vs legacy_chunk_text. CPU only, no GPU.
+    (A function, not a local_entrypoint: deploy() must stay the only entrypoint.)
+
+    Run with: modal run streaming_sanskrit_tts_optimized.py::benchmark_chunker
+    """
+    shloka = "धर्मक्षेत्रे कुरुक्षेत्रे समवेता युयुत्सवः । मामकाः पाण्डवाश्चैव किमकुर्वत सञ्जय ॥ १ ॥"
+    texts = {
+        "short": "नमस्ते। संस्कृतं पठामः।",
+        "verses": " ".join([shloka] * 6),
+        "one_long_sentence": " ".join(["रामः वनं गच्छति, सीता अपि"] * 12) + "।",
+        "mixed_punctuation": "किम् एतत्? अहो! " * 10 + "This is fine. Is it? Yes!",
+    }
+    
+    for name, text in texts.items():
+        for label, chunker in (("legacy", legacy_chunk_text), ("new", chunk_sanskrit_text)):
+            start = time.perf_counter()
+            for _ in range(repeats):
+                chunks = chunker(text, max_words)
+            per_call_us = (time.perf_counter() - start) / repeats * 1e6
+            sizes = [len(split_words(chunk)) for chunk in chunks]
+            print(f"⏱️ {name:18s} {label:6s}: {per_call_us:8.1f} µs/call, {len(chunks)} chunks, "
+                  f"words per chunk {sizes} (max {max(sizes)})")
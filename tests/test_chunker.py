@@ -0,0 +1,184 @@
+"""Property tests for the Devanagari-aware text chunker (chunk_sanskrit_text).
+
+Pure Python, no GPU: importing the service module only needs `modal`.
+Run with: python -m pytest tests
+"""
+
+import os
+import random
+import sys
+
+import pytest
+
+pytest.importorskip("modal")
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "modal_tts"))
+
+import streaming_sanskrit_tts_optimized as tts  # noqa: E402
+
+WORDS = ["धर्मक्षेत्रे", "कुरुक्षेत्रे", "समवेता", "युयुत्सवः", "मामकाः", "पाण्डवाश्चैव",
+         "किमकुर्वत", "सञ्जय", "रामः", "वनं", "गच्छति", "सीता", "अपि", "hello", "world"]
+# Attached to the previous word, or as a token of their own after a space
+PUNCTUATION = ["।", "॥", "?", "!", ",", ";", "॥ १ ॥", "|", "||"]
+
+
+def random_text(rng: random.Random, max_tokens: int = 80) -> str:
+    tokens = []
+    for _ in range(rng.randint(1, max_tokens)):
+        token = rng.choice(WORDS)
+        if rng.random() < 0.25:
+            token += (" " if rng.random() < 0.5 else "") + rng.choice(PUNCTUATION)
+        tokens.append(token)
+    return " ".join(tokens)
+
+
+def squeeze(text: str) -> str:
+    """Text without whitespace: what the chunker must preserve, in order"""
+    return "".join(text.split())
+
+
+def same_text(chunks: list, text: str) -> bool:
+    """Chunks read exactly as text, up to runs of whitespace"""
+    return " ".join(chunks).split() == text.split()
+
+
+@pytest.mark.parametrize("max_words", [1, 2, 4, 7, 20])
+def test_chunks_respect_max_words_and_keep_word_order(max_words):
+    rng = random.Random(max_words)
+    for _ in range(300):
+        text = random_text(rng)
+        chunks = tts.chunk_sanskrit_text(text, max_words)
+        assert same_text(chunks, text)
+        assert all(1 <= len(tts.split_words(chunk)) <= max_words for chunk in chunks)
+
+
+@pytest.mark.parametrize("first_max_words", [1, 3, 4])
+def test_first_chunk_bound(first_max_words):
+    rng = random.Random(100 + first_max_words)
+    for _ in range(300):
+        text = random_text(rng)
+        chunks = tts.chunk_sanskrit_text(text, 20, first_max_words)
+        assert same_text(chunks, text)
+        assert len(tts.split_words(chunks[0])) <= first_max_words
+        assert all(len(tts.split_words(chunk)) <= 20 for chunk in chunks[1:])
+
+
+def test_no_chunk_starts_with_punctuation():
+    rng = random.Random(7)
+    for _ in range(300):
+        for chunk in tts.chunk_sanskrit_text(random_text(rng), 5):
+            assert not tts.PUNCTUATION_TOKEN_RE.match(chunk.split()[0])
+
+
+def test_empty_text():
+    assert tts.chunk_sanskrit_text("") == []
+    assert tts.chunk_sanskrit_text("   ") == []
+
+
+@pytest.mark.parametrize("mark", ["।", "॥", "?", "!", ".", "|", "||"])
+def test_sentence_marks_are_preferred_cut_points(mark):
+    first = "रामः वनं गच्छति सीता अपि"
+    second = "मामकाः पाण्डवाश्चैव किमकुर्वत सञ्जय"
+    # Two five- and four-word sentences can't share a 6-word chunk: cut at the mark
+    assert tts.chunk_sanskrit_text(f"{first}{mark} {second}{mark}", 6) == [f"{first}{mark}", f"{second}{mark}"]
+
+
+def test_spaced_danda_and_verse_numbers_stay_with_their_words():
+    shloka = "धर्मक्षेत्रे कुरुक्षेत्रे समवेता युयुत्सवः । मामकाः पाण्डवाश्चैव किमकुर्वत सञ्जय ॥ १ ॥"
+    assert tts.chunk_sanskrit_text(shloka, 4) == [
+        "धर्मक्षेत्रे कुरुक्षेत्रे समवेता युयुत्सवः ।",
+        "मामकाः पाण्डवाश्चैव किमकुर्वत सञ्जय ॥ १ ॥",
+    ]
+
+
+def test_clause_mark_beats_bare_word_break():
+    text = "रामः वनं, गच्छति सीता अपि रामः"
+    chunks = tts.chunk_sanskrit_text(text, 4)
+    assert chunks[0] == "रामः वनं,"
+
+
+def test_small_first_chunk_takes_the_whole_reach_without_a_boundary():
+    text = "अद्य वयं संस्कृतभाषायां धातुरूपाणि पठामः। रामः वनं गच्छति सीता अपि गच्छति।"
+    chunks = tts.plan_text_chunks(text, "small_first")
+    assert chunks[0] == "अद्य वयं संस्कृतभाषायां धातुरूपाणि"
+    assert squeeze(" ".join(chunks)) == squeeze(text)
+
+
+def test_small_first_chunk_ends_at_a_boundary_in_reach():
+    rng = random.Random(22)
+    limit = tts.FIRST_CHUNK_MAX_WORDS
+    for _ in range(300):
+        words = tts.split_words(random_text(rng))
+        first = tts.split_words(tts.plan_text_chunks(" ".join(words), "small_first")[0])
+        if len(words) <= limit:
+            assert first == words
+            continue
+        breaks = [tts.word_break(word) for word in words[:limit]]
+        if "sentence" in breaks or "clause" in breaks:
+            assert tts.word_break(first[-1]) in ("sentence", "clause")
+        else:
+            assert len(first) == limit
+
+
+def feed(chunker, text: str, rng: random.Random) -> list:
+    """Append text in random LLM-token-sized pieces, then flush"""
+    chunks, i = [], 0
+    while i < len(text):
+        step = rng.randint(1, 8)
+        chunks += chunker.append(text[i:i + step])
+        i += step
+    return chunks + chunker.flush()
+
+
+def test_incremental_chunker_properties():
+    rng = random.Random(24)
+    for _ in range(500):
+        text = random_text(rng)
+        chunks = feed(tts.IncrementalChunker(max_words=6, first_max_words=3), text, rng)
+        assert same_text(chunks, text)
+        assert len(tts.split_words(chunks[0])) <= 3
+        assert all(len(tts.split_words(chunk)) <= 6 for chunk in chunks)
+        # Punctuation-only tokens never open a chunk of their own
+        assert all(not tts.PUNCTUATION_TOKEN_RE.match(chunk.split()[0]) for chunk in chunks)
+
+
+def test_incremental_chunker_keeps_verse_numbers_with_their_sentence():
+    tokens = ["धर्मक्षेत्रे ", "कुरुक्षेत्रे ", "समवेता ", "युयुत्सवः", " ।", " मामकाः ", "पाण्डवाश्चैव ",
+              "किमकुर्वत ", "सञ्जय ", "॥", " १", " ॥"]
+    chunker = tts.IncrementalChunker(first_max_words=4)
+    released = [chunker.append(token) for token in tokens]
+    # The first sentence goes as soon as the next word starts, not before
+    assert released[4] == [] and released[5] == ["धर्मक्षेत्रे कुरुक्षेत्रे समवेता युयुत्सवः ।"]
+    assert sum(released, [])[1:] + chunker.flush() == ["मामकाः पाण्डवाश्चैव किमकुर्वत सञ्जय ॥ १ ॥"]
+
+
+def test_incremental_chunker_flush_drops_bare_punctuation():
+    chunker = tts.IncrementalChunker()
+    assert chunker.append("॥ १ ॥") == []
+    assert chunker.flush() == []
+
+
+@pytest.mark.parametrize("text", [
+    "मम वयः 25 वर्षाणि।",
+    "अध्यायः १०८ पठामः।",
+    "Hello , world - this is 2024 .",
+])
+def test_numbers_and_spaced_punctuation_are_read_unchanged(text):
+    assert tts.chunk_sanskrit_text(text) == [text]
+    assert same_text(tts.plan_text_chunks(text, "small_first"), text)
+    chunker = tts.IncrementalChunker()
+    assert same_text(chunker.append(text + " ") + chunker.flush(), text)
+
+
+def test_numbers_inside_a_sentence_are_words():
+    assert tts.split_words("मम वयः 25 वर्षाणि") == ["मम", "वयः", "25", "वर्षाणि"]
+    assert tts.split_words("पाठः 3") == ["पाठः", "3"]
+    # ...but a verse number after a danda closes its verse
+    assert tts.split_words("सञ्जय ॥ १ ॥ धृतराष्ट्र") == ["सञ्जय ॥ १ ॥", "धृतराष्ट्र"]
+
+
+def test_incremental_chunker_keeps_number_spacing():
+    chunker = tts.IncrementalChunker(max_words=2, first_max_words=2)
+    chunks = []
+    for token in ["पाठः", " 3", " अस्ति", " सरलः"]:
+        chunks += chunker.append(token)
+    assert chunks + chunker.flush() == ["पाठः 3", "अस्ति सरलः"]
@@ -0,0 +1,53 @@
+"""CoalescedStream: fan-out of one generation, and stopping a reader mid-block.
+
+Pure Python threads, no GPU. Run with: python -m pytest tests
+"""
+
+import os
+import sys
+import threading
+
+import pytest
+
+pytest.importorskip("modal")
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "modal_tts"))
+
+import streaming_sanskrit_tts_optimized as tts  # noqa: E402
+
+
+def test_late_subscriber_replays_then_follows():
+    flight = tts.CoalescedStream("key")
+    assert flight.attach() == 0
+    flight.publish("a")
+    assert flight.attach() == 1
+    flight.publish("b")
+    flight.finish({"complete": True})
+    assert list(flight) == ["a", "b"]
+
+
+def test_stop_ends_a_reader_waiting_for_the_next_block():
+    flight = tts.CoalescedStream("key")
+    flight.attach()
+    flight.publish("a")
+    stop = threading.Event()
+    read = []
+    reader = threading.Thread(target=lambda: read.extend(flight.follow(stop)))
+    reader.start()
+    reader.join(0.2)
+    assert reader.is_alive() and read == ["a"]
+    # What _watch_cancellations does for a cancelled request, before the next block exists
+    stop.set()
+    flight.wake()
+    reader.join(1.0)
+    assert not reader.is_alive()
+    # The last subscriber leaving stops the generation
+    flight.detach()
+    assert flight.cancel_event.is_set()
+
+
+def test_one_subscriber_leaving_keeps_the_generation_for_the_others():
+    flight = tts.CoalescedStream("key")
+    flight.attach()
+    flight.attach()
+    flight.detach()
+    assert not flight.cancel_event.is_set()
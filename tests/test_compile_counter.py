@@ -0,0 +1,93 @@
+"""CompileEventCounter: graph changes after warmup must be caught.
+
+The torch counters are replaced by plain integers, so no GPU is needed.
+Run with: python -m pytest tests
+"""
+
+import os
+import sys
+
+import pytest
+
+pytest.importorskip("modal")
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "modal_tts"))
+
+import streaming_sanskrit_tts_optimized as tts  # noqa: E402
+
+SHAPE = (1, 32, 128, 256)
+
+
+def fake_counter():
+    counter = tts.CompileEventCounter()
+    counter.graphs = counter.rerecords = 0
+    counter._compiled_graphs = lambda: counter.graphs
+    counter._cudagraph_rerecords = lambda: counter.rerecords
+    return counter
+
+
+def test_warmup_compiles_and_rerecords_are_not_counted():
+    counter = fake_counter()
+    counter.graphs, counter.rerecords = 5, 3
+    counter.observe(SHAPE, "warmup")
+    counter.mark_steady_state()
+    counter.observe(SHAPE, "request")
+    stats = counter.stats()
+    assert stats["recompile_events"] == 0 and stats["cudagraph_rerecord_events"] == 0
+    tts.check_compile_steady_state(stats)
+
+
+def test_cudagraph_rerecord_after_warmup_fails_the_check():
+    counter = fake_counter()
+    counter.mark_steady_state()
+    counter.rerecords += 1
+    counter.observe(SHAPE, "request")
+    assert counter.stats()["cudagraph_rerecord_events"] == 1
+    with pytest.raises(RuntimeError, match="re-record"):
+        tts.check_compile_steady_state(counter.stats())
+
+
+def test_recompile_after_warmup_fails_the_check():
+    counter = fake_counter()
+    counter.mark_steady_state()
+    counter.graphs += 2
+    counter.observe((2, 32, 128, 256), "request")
+    stats = counter.stats()
+    assert stats["recompile_events"] == 1 and stats["new_shapes_after_steady_state"] == 1
+    with pytest.raises(RuntimeError, match="recompile"):
+        tts.check_compile_steady_state(stats)
+
+
+def test_live_shapes_exclude_warmup():
+    counter = fake_counter()
+    counter.observe(SHAPE, "warmup")
+    counter.mark_steady_state()
+    counter.observe(SHAPE, "request")
+    counter.observe((2, 32, 128, 256), "request")
+    stats = counter.stats()
+    assert stats["shapes"] == {"1x32x128x256": 1, "2x32x128x256": 1}
+    assert stats["new_shapes_after_steady_state"] == 1
+
+
+def test_warmup_covers_every_description_bucket_without_traffic():
+    shapes = tts.warmup_shapes([32, 64])
+    assert {description for _, _, description in shapes} == {32, 64}
+    assert len(shapes) == len(tts.BATCH_SIZE_BUCKETS) * len(tts.PROMPT_LENGTH_BUCKETS) * 2
+
+
+def test_warmup_narrows_to_served_shapes():
+    served = {"1x32x64x512": 40, "1x32x64x1024": 10, "1x16x32x256": 5, "8x64x32x2000": 1, "1x512x64x2000": 3}
+    shapes = tts.warmup_shapes([32, 64], served)
+    longest = tts.PROMPT_LENGTH_BUCKETS[-1]
+    # Served on-bucket shapes (budgets merged), plus the cache-allocating longest prompt per group
+    assert shapes == [(1, longest, 32), (1, 16, 32), (1, longest, 64), (1, 32, 64), (8, longest, 32), (8, 64, 32)]
+
+
+def test_warmup_keeps_the_most_served_shapes():
+    served = {f"1x{prompt}x32x512": prompt for prompt in tts.PROMPT_LENGTH_BUCKETS}
+    served.update({f"{rows}x16x32x512": 1000 + rows for rows in tts.BATCH_SIZE_BUCKETS})
+    shapes = tts.warmup_shapes([32], served)
+    assert len(shapes) <= tts.WARMUP_MAX_SHAPES + len(tts.BATCH_SIZE_BUCKETS)
+    assert all((rows, 16, 32) in shapes for rows in tts.BATCH_SIZE_BUCKETS)
+    # Each group's first shape allocates its static cache at the longest prompt
+    firsts = [shape for i, shape in enumerate(shapes) if i == 0 or shape[0] != shapes[i - 1][0]]
+    assert all(prompt == tts.PROMPT_LENGTH_BUCKETS[-1] for _, prompt, _ in firsts)
@@ -0,0 +1,57 @@
+"""A seed must give the same audio from stream_synthesis and batch_synthesis.
+
+Checks the pure-Python half of that: both paths must cut the text into the same
+chunks and run the same play_steps policy. Run with: python -m pytest tests
+"""
+
+import os
+import sys
+
+import pytest
+
+pytest.importorskip("modal")
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "modal_tts"))
+
+import streaming_sanskrit_tts_optimized as tts  # noqa: E402
+
+TEXTS = [
+    "अद्य वयं संस्कृतभाषायां धातुरूपाणि पठामः। रामः वनं गच्छति सीता अपि गच्छति।",
+    "धर्मक्षेत्रे कुरुक्षेत्रे समवेता युयुत्सवः । मामकाः पाण्डवाश्चैव किमकुर्वत सञ्जय ॥ १ ॥",
+    "Hello , world - this is 2024 .",
+]
+
+
+@pytest.mark.parametrize("chunk_plan", tts.CHUNK_PLANS)
+@pytest.mark.parametrize("policy", tts.PLAY_STEPS_POLICIES)
+def test_seeded_streams_run_the_batch_chunks_with_fixed_play_steps(chunk_plan, policy):
+    for seed in (0, 7):
+        plan, seeded_policy = tts.seeded_stream_options(seed, chunk_plan, policy)
+        assert seeded_policy == "fixed"
+        for text in TEXTS:
+            # batch_synthesis chunks with chunk_text(text, max_words=20)
+            assert tts.plan_text_chunks(text, plan) == tts.chunk_sanskrit_text(text, 20)
+
+
+@pytest.mark.parametrize("chunk_plan", tts.CHUNK_PLANS)
+@pytest.mark.parametrize("policy", tts.PLAY_STEPS_POLICIES)
+def test_unseeded_streams_keep_the_requested_options(chunk_plan, policy):
+    assert tts.seeded_stream_options(None, chunk_plan, policy) == (chunk_plan, policy)
+
+
+def test_stream_start_reports_the_plan_a_seeded_stream_runs():
+    options, error = tts.parse_stream_options({"seed": 3, "chunk_plan": "small_first", "play_steps_policy": "adaptive"})
+    assert error is None
+    assert (options["chunk_plan"], options["play_steps_policy"]) == ("uniform", "fixed")
+    options, _ = tts.parse_stream_options({})
+    assert (options["chunk_plan"], options["play_steps_policy"]) == (
+        tts.STREAM_DEFAULT_CHUNK_PLAN, tts.STREAM_DEFAULT_PLAY_STEPS_POLICY
+    )
+
+
+def test_deterministic_mode_announces_the_seeded_options(monkeypatch):
+    # Unseeded requests get DETERMINISTIC_DEFAULT_SEED on the service, so stream_start
+    # must already report the slower seeded plan and policy
+    monkeypatch.setattr(tts, "DETERMINISTIC_MODE", True)
+    options, error = tts.parse_stream_options({"chunk_plan": "small_first", "play_steps_policy": "adaptive"})
+    assert error is None
+    assert (options["chunk_plan"], options["play_steps_policy"]) == ("uniform", "fixed")
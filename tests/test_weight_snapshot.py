@@ -0,0 +1,48 @@
+"""Weight snapshot manifests: a snapshot of another model must not be served.
+
+Run with: python -m pytest tests
+"""
+
+import json
+import os
+import sys
+
+import pytest
+
+pytest.importorskip("modal")
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "modal_tts"))
+
+import streaming_sanskrit_tts_optimized as tts  # noqa: E402
+
+
+def manifest(**overrides):
+    return {"model_id": tts.MODEL_ID, "revision": tts.MODEL_REVISION, "dtype": "float16", **overrides}
+
+
+def test_snapshot_of_the_served_model_matches():
+    assert tts.snapshot_matches(manifest())
+
+
+@pytest.mark.parametrize("overrides", [
+    {"model_id": "parler-tts/parler-tts-mini-v1"},
+    {"revision": "0123abcd"},
+    {"dtype": "bfloat16"},
+])
+def test_stale_snapshots_do_not_match(overrides):
+    assert not tts.snapshot_matches(manifest(**overrides))
+
+
+def test_snapshots_from_before_revisions_were_recorded_do_not_match():
+    old = manifest()
+    del old["revision"]
+    assert not tts.snapshot_matches(old)
+    assert not tts.snapshot_matches(None)
+
+
+def test_read_snapshot_manifest(tmp_path, monkeypatch):
+    monkeypatch.setattr(tts, "WEIGHT_SNAPSHOT_DIR", str(tmp_path))
+    assert tts.read_snapshot_manifest() is None
+    (tmp_path / tts.WEIGHT_SNAPSHOT_MANIFEST).write_text("{not json")
+    assert tts.read_snapshot_manifest() is None
+    (tmp_path / tts.WEIGHT_SNAPSHOT_MANIFEST).write_text(json.dumps(manifest()))
+    assert tts.snapshot_matches(tts.read_snapshot_manifest())